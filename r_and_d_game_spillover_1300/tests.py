@@ -0,0 +1,47 @@
+from otree.api import Bot, Submission, SubmissionMustFail, expect
+import random
+from . import *
+
+
+class PlayerBot(Bot):
+    def play_round(self):
+        if self.round_number == 1:
+            yield Introduction
+        yield SubmissionMustFail(Investment, dict(cards_invested=Constants.cards_per_player + 1))
+        yield Investment, dict(cards_invested=random.randint(0, Constants.cards_per_player))
+
+        # グループの結果と保存済みの要約が一致すること
+        group = self.group
+        players = group.get_players()
+        expect(group.total_cards_invested, sum(p.cards_invested for p in players))
+        expect(group.success_percent, int(group.success_probability * 100))
+        if group.is_rd_successful:
+            expect(group.winner_id, group.successful_player + 1)
+            expect(sum(p.is_winner for p in players), 1)
+        else:
+            expect(sum(p.is_winner for p in players), 0)
+
+        # 累積値は全ラウンドの合計と一致すること
+        rounds = self.player.in_all_rounds()
+        expect(self.player.total_investment, sum(p.cards_invested * Constants.card_value for p in rounds))
+        expect(self.player.cumulative_payoff, sum(int(p.payoff) for p in rounds))
+        yield Results
+        if self.round_number == Constants.num_rounds:
+            check_totals(self.player)
+            yield FinalResults
+
+
+def check_totals(player):
+    """全10ラウンドの累積値が、各ラウンドまでの合計と一致すること"""
+    rounds = player.in_all_rounds()
+    expect(len(rounds), Constants.num_rounds)
+    total_investment = 0
+    cumulative_payoff = 0
+    for p in rounds:
+        total_investment += p.cards_invested * Constants.card_value
+        cumulative_payoff += int(p.payoff)
+        expect(p.total_investment, total_investment)
+        expect(p.cumulative_payoff, cumulative_payoff)
+    # 持ち越しに使う参加者変数も最終ラウンドの値であること
+    expect(player.participant.vars['total_investment'], total_investment)
+    expect(player.participant.vars['cumulative_payoff'], cumulative_payoff)
@@ -0,0 +1,154 @@
+"""
+R&D投資ゲーム共通の計算エンジン
+
+3つのR&Dアプリ（spillover_700 / spillover_1300 / winner_takes_all）は
+ここで定義する定数と Engine を共有する。成功確率と利益はインポート時に
+テーブルとして事前計算し、結果の計算は配列の参照だけで行う。
+モデルのメソッドとページは rd_engine.game で共通に定義する。
+"""
+# 処遇条件
+SPILL_OVER = 0
+WINNER_TAKES_ALL = 1
+TREATMENTS = (SPILL_OVER, WINNER_TAKES_ALL)
+TREATMENT_NAMES = {
+    'spill_over': SPILL_OVER,
+    'winner_takes_all': WINNER_TAKES_ALL,
+}
+
+# 結果の種類
+FAILURE = 0  # R&D失敗
+WINNER = 1  # R&D成功・当選
+LOSER = 2  # R&D成功・落選
+OUTCOMES = (FAILURE, WINNER, LOSER)
+
+# 共通のゲーム設定
+PLAYERS_PER_GROUP = 4
+NUM_ROUNDS = 10
+# 各プレイヤーの初期カード枚数
+CARDS_PER_PLAYER = 5
+# カード1枚の価値（億円）
+CARD_VALUE = 50
+# 成功時の報酬（億円）
+SUCCESS_REWARD = 1500
+# サイコロの目の数
+DICE_FACES = 6
+
+# 成功確率の閾値
+SUCCESS_THRESHOLDS = {
+    (0, 4): 0,      # 0-4枚: 0%
+    (5, 11): 1/3,   # 5-11枚: 33.3%
+    (12, 16): 1/2,  # 12-16枚: 50%
+    (17, 20): 2/3   # 17-20枚: 66.7%
+}
+
+
+class Engine:
+    """報酬設定ごとの成功確率テーブルと利益テーブルを保持する"""
+
+    def __init__(
+        self,
+        spillover_reward,
+        success_reward=SUCCESS_REWARD,
+        card_value=CARD_VALUE,
+        cards_per_player=CARDS_PER_PLAYER,
+        players_per_group=PLAYERS_PER_GROUP,
+        success_thresholds=SUCCESS_THRESHOLDS,
+    ):
+        self.spillover_reward = spillover_reward
+        self.success_reward = success_reward
+        self.card_value = card_value
+        self.cards_per_player = cards_per_player
+        self.players_per_group = players_per_group
+        self.max_total_cards = players_per_group * cards_per_player
+
+        # 合計枚数 (0..players*cards) ごとの成功確率
+        self.success_probability = [0] * (self.max_total_cards + 1)
+        for (min_cards, max_cards), probability in success_thresholds.items():
+            for total in range(max(min_cards, 0), min(max_cards, self.max_total_cards) + 1):
+                self.success_probability[total] = probability
+        # 合計枚数ごとの「この目以下なら成功」となるサイコロの目
+        self.success_faces = [
+            int(probability * DICE_FACES + 1e-9) for probability in self.success_probability
+        ]
+
+        # (処遇条件, 結果, 投資枚数) で引く利益のフラットなテーブル
+        self.payoffs = []
+        for treatment in TREATMENTS:
+            for outcome in OUTCOMES:
+                for cards in range(cards_per_player + 1):
+                    self.payoffs.append(self._payoff_rule(cards, outcome, treatment))
+
+        # 投資ページの計算機に js_vars で渡す表（処遇条件ごと）
+        self.preview_tables = {
+            treatment: dict(
+                players_per_group=players_per_group,
+                cards_per_player=cards_per_player,
+                success_probability=self.success_probability,
+                payoffs={
+                    name: [self.payoff(cards, outcome, treatment) for cards in range(cards_per_player + 1)]
+                    for name, outcome in (('failure', FAILURE), ('winner', WINNER), ('loser', LOSER))
+                },
+            )
+            for treatment in TREATMENTS
+        }
+
+    def _payoff_rule(self, cards, outcome, treatment):
+        """利益の定義（テーブル作成時にのみ使う）"""
+        cost = cards * self.card_value
+        if outcome == WINNER:
+            # 成功したプレイヤー: 報酬から今回の投資額のみを差し引く
+            return self.success_reward - cost
+        if outcome == LOSER and treatment == SPILL_OVER:
+            # SpillOver条件の落選者
+            return self.spillover_reward - cost
+        # 失敗、または勝者総取り条件の落選者は投資額のみが損失
+        return -cost
+
+    def payoff(self, cards, outcome, treatment):
+        """利益テーブルを参照"""
+        return self.payoffs[
+            (treatment * len(OUTCOMES) + outcome) * (self.cards_per_player + 1) + cards
+        ]
+
+    def resolve(self, investments, treatment, draws=None):
+        """グループごとの投資額の行列から、各グループの結果を一括で計算
+
+        draws には各グループの (サイコロの目, 当選者抽選用の一様乱数) を渡す。
+        None のグループはその場で乱数を引く。
+        """
+        from rd_engine import rng
+
+        if draws is None:
+            draws = [None] * len(investments)
+        results = []
+        for player_investments, draw in zip(investments, draws):
+            total = sum(player_investments)
+            dice_roll, u = draw if draw is not None else rng.fresh_draw()
+
+            # R&D成功判定
+            is_successful = dice_roll <= self.success_faces[total]
+
+            successful_player = None
+            if is_successful:
+                # 成功した場合、投資額に比例して当選者を選ぶ
+                successful_player = rng.pick_weighted(player_investments, u)
+
+            payoffs = []
+            for i, cards in enumerate(player_investments):
+                if not is_successful:
+                    outcome = FAILURE
+                elif i == successful_player:
+                    outcome = WINNER
+                else:
+                    outcome = LOSER
+                payoffs.append(self.payoff(cards, outcome, treatment))
+
+            results.append(dict(
+                total_cards_invested=total,
+                success_probability=self.success_probability[total],
+                dice_roll=dice_roll,
+                is_rd_successful=is_successful,
+                successful_player=successful_player,
+                payoffs=payoffs,
+            ))
+        return results
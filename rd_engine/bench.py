@@ -0,0 +1,342 @@
+"""
+devserver に対する負荷試験とレイテンシのベンチマーク
+
+ローカルの devserver を起動し（--url で既存のサーバーも指定可）、REST API で
+セッションを作成して、指定した人数の参加者を HTTP で最後まで進める。
+入力は各ページのフォームの範囲内でランダムに選ぶ。
+
+記録する指標（アプリ・人数ごと）:
+- create_seconds: セッション作成（REST API）にかかった時間
+- wall_seconds: 全参加者が最後のページを終えるまでの時間
+- render_p50 / render_p95 / render_max: ページ送信から次のページの表示までの時間
+  （待機ページの再読み込みは除く）
+- aapa_p50 / aapa_p95 / aapa_max: after_all_players_arrive の処理時間
+  （サーバー側で rd_engine.instrumentation が RD_BENCH_TIMINGS に記録した値）
+
+--save-baseline で結果を基準値として保存し、--baseline を指定すると
+基準値より許容幅（--tolerance）を超えて遅くなった指標を報告して終了コード 1 を返す。
+
+ライブモード（live_investment）は WebSocket を使うため対象外。
+
+使い方:
+    python -m rd_engine.bench --apps r_and_d_game_spillover_700 --participants 12,100 \\
+        --save-baseline bench_baseline.json
+    python -m rd_engine.bench --baseline bench_baseline.json
+"""
+import argparse
+import html.parser
+import http.client
+import json
+import os
+import queue
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from rd_engine.instrumentation import TIMINGS_ENV, read_timings
+
+DEFAULT_APPS = (
+    'r_and_d_game_spillover_700',
+    'r_and_d_game_spillover_1300',
+    'r_and_d_game_winner_takes_all',
+    'two_stage_contest',
+)
+DEFAULT_PARTICIPANTS = (12, 100, 500, 1000)
+# 基準値と比較する指標
+CHECKED = ('wall_seconds', 'render_p95', 'aapa_p95')
+# 短い処理の揺らぎで失敗しないための許容幅の下限（秒）
+MIN_SLACK = 0.005
+# 待機ページを再読み込みする間隔（秒）
+POLL_SECONDS = 0.2
+WAIT_PAGE_MARKER = 'otree-wait-page'
+FINISHED_MARKER = 'OutOfRangeNotification'
+
+
+def percentile(values, q):
+    """q (0〜1) 分位点（最近傍法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(prefix, values):
+    return {
+        f'{prefix}_p50': percentile(values, 0.5),
+        f'{prefix}_p95': percentile(values, 0.95),
+        f'{prefix}_max': max(values, default=0.0),
+    }
+
+
+class FormParser(html.parser.HTMLParser):
+    """ページの入力欄（name, min, max, type）を集める"""
+
+    def __init__(self):
+        super().__init__()
+        self.inputs = {}
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        name = attrs.get('name')
+        if tag not in ('input', 'select') or not name or attrs.get('type') in ('hidden', 'submit'):
+            return
+        field = self.inputs.setdefault(name, {'values': []})
+        if attrs.get('type') == 'radio':
+            field['values'].append(attrs.get('value'))
+        else:
+            field['min'] = attrs.get('min')
+            field['max'] = attrs.get('max')
+
+
+def random_form(page_html, generator):
+    """フォームの各入力欄に範囲内のランダムな値を入れる"""
+    parser = FormParser()
+    parser.feed(page_html)
+    data = {}
+    for name, field in parser.inputs.items():
+        if field['values']:
+            data[name] = generator.choice(field['values'])
+        elif field.get('min') is not None and field.get('max') is not None:
+            data[name] = generator.randint(int(field['min']), int(field['max']))
+    return data
+
+
+class Client:
+    """スレッドごとの keep-alive 接続（リダイレクトは自前で追う）"""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        """(最終的なパス, ステータス, 本文) を返す"""
+        while True:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            try:
+                self.connection.request(method, path, body=body, headers=headers or {})
+                response = self.connection.getresponse()
+                text = response.read().decode('utf-8', errors='replace')
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                raise
+            if response.status in (301, 302, 303, 307):
+                path = urllib.parse.urlsplit(response.getheader('Location')).path
+                method, body, headers = 'GET', None, None
+                continue
+            return path, response.status, text
+
+    def post_json(self, path, payload):
+        _, status, text = self.request(
+            'POST', path, json.dumps(payload), {'Content-Type': 'application/json'},
+        )
+        if status != 200:
+            raise RuntimeError(f'{path}: HTTP {status}: {text[:200]}')
+        return json.loads(text)
+
+
+class Participant:
+    def __init__(self, code):
+        self.code = code
+        self.path = None
+        self.html = ''
+
+    def waiting(self):
+        return WAIT_PAGE_MARKER in self.html
+
+
+def run_session(url, app, num_participants, workers, seed=0):
+    """1セッションを最後まで進め、クライアント側の指標を返す"""
+    client = Client(url)
+    start = time.perf_counter()
+    code = client.post_json('/api/sessions', {
+        'session_config_name': app, 'num_participants': num_participants,
+    })['code']
+    create_seconds = time.perf_counter() - start
+    session = client.post_json(f'/api/get_session/{code}', {})
+    participants = [Participant(p['code']) for p in session['participants']]
+
+    ready = queue.PriorityQueue()
+    for i, participant in enumerate(participants):
+        ready.put((0.0, i, participant))
+    render_times = []
+    errors = []
+    remaining = [len(participants)]
+    lock = threading.Lock()
+
+    def step(client, participant, generator):
+        """参加者を1リクエスト分進め、次に進められる時刻を返す（終了時は None）"""
+        if participant.path is None:
+            path = f'/InitializeParticipant/{participant.code}'
+            method, body = 'GET', None
+        elif participant.waiting():
+            path, method, body = participant.path, 'GET', None
+        else:
+            path, method = participant.path, 'POST'
+            body = urllib.parse.urlencode(random_form(participant.html, generator))
+        was_waiting = participant.path is not None and participant.waiting()
+        begin = time.perf_counter()
+        final_path, status, text = client.request(
+            method, path, body, {'Content-Type': 'application/x-www-form-urlencoded'} if method == 'POST' else None,
+        )
+        elapsed = time.perf_counter() - begin
+        if status != 200:
+            raise RuntimeError(f'{final_path}: HTTP {status}: {text[:200]}')
+        if final_path == path and method == 'POST':
+            raise RuntimeError(f'{path}: 送信が受け付けられませんでした {body}')
+        participant.path, participant.html = final_path, text
+        if FINISHED_MARKER in final_path:
+            return None
+        if not was_waiting or final_path != path:
+            with lock:
+                render_times.append(elapsed)
+        if participant.waiting():
+            return time.perf_counter() + POLL_SECONDS
+        return time.perf_counter()
+
+    def worker(index):
+        client = Client(url)
+        generator = random.Random(seed * 1000 + index)
+        while True:
+            when, i, participant = ready.get()
+            if participant is None:
+                return
+            delay = when - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                when = step(client, participant, generator)
+            except Exception as error:  # noqa: BLE001  参加者ごとに失敗を記録して続ける
+                errors.append(f'{participant.code}: {error}')
+                when = None
+            if when is None:
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        for _ in range(workers):
+                            ready.put((0.0, -1, None))
+            else:
+                ready.put((when, i, participant))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError(f'{len(errors)} 人の参加者が失敗しました: {errors[0]}')
+    return dict(
+        session_code=code,
+        create_seconds=create_seconds,
+        wall_seconds=time.perf_counter() - start,
+        requests=len(render_times),
+        **summarize('render', render_times),
+    )
+
+
+def wait_until_up(url, process, timeout=60):
+    deadline = time.time() + timeout
+    client = Client(url)
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError('devserver が起動できませんでした')
+        try:
+            client.request('GET', '/')
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f'{url} に接続できません')
+
+
+def start_devserver(port, timings_path):
+    env = dict(os.environ, **{TIMINGS_ENV: timings_path})
+    process = subprocess.Popen(
+        ['otree', 'devserver', str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True,
+    )
+    return process
+
+
+def stop_devserver(process):
+    if process is not None and process.poll() is None:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+
+
+def compare(results, baseline, tolerance):
+    """基準値より遅くなった指標を (キー, 指標, 基準値, 今回) のリストで返す"""
+    regressions = []
+    for key, metrics in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for name in CHECKED:
+            if name in reference and metrics[name] > reference[name] * (1 + tolerance) + MIN_SLACK:
+                regressions.append((key, name, reference[name], metrics[name]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='devserver に対する負荷試験とレイテンシの計測')
+    parser.add_argument('--apps', default=','.join(DEFAULT_APPS), help='セッション設定名（カンマ区切り）')
+    parser.add_argument('--participants', default=','.join(map(str, DEFAULT_PARTICIPANTS)),
+                        help='参加者数（カンマ区切り）')
+    parser.add_argument('--url', help='起動済みのサーバー（省略時は devserver を起動する）')
+    parser.add_argument('--port', type=int, default=8765, help='起動する devserver のポート')
+    parser.add_argument('--workers', type=int, default=16, help='同時にリクエストを送るスレッド数')
+    parser.add_argument('--baseline', help='比較する基準値の JSON')
+    parser.add_argument('--save-baseline', help='結果を基準値として保存する JSON')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='基準値からの許容幅（割合）')
+    args = parser.parse_args(argv)
+
+    apps = args.apps.split(',')
+    sizes = [int(n) for n in args.participants.split(',')]
+    timings_path = os.path.join(tempfile.mkdtemp(prefix='rd_bench_'), 'timings.jsonl')
+    process = None
+    url = args.url
+    if url is None:
+        url = f'http://127.0.0.1:{args.port}'
+        process = start_devserver(args.port, timings_path)
+    results = {}
+    try:
+        wait_until_up(url, process)
+        for app in apps:
+            for num_participants in sizes:
+                if os.path.exists(timings_path):
+                    os.remove(timings_path)
+                metrics = run_session(url, app, num_participants, args.workers)
+                # --url のサーバーで計測を有効にしていなければ aapa は 0 になる
+                metrics.update(summarize('aapa', read_timings(timings_path)))
+                key = f'{app}:{num_participants}'
+                results[key] = metrics
+                print(f'{key:<40} wall={metrics["wall_seconds"]:.2f}s '
+                      f'render p50={metrics["render_p50"] * 1000:.1f}ms '
+                      f'p95={metrics["render_p95"] * 1000:.1f}ms '
+                      f'aapa p95={metrics["aapa_p95"] * 1000:.1f}ms '
+                      f'({metrics["requests"]} リクエスト)', flush=True)
+    finally:
+        stop_devserver(process)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, name, reference, current in regressions:
+            print(f'  遅くなりました: {key} {name}: 基準値={reference:.4f} 今回={current:.4f}')
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+ボット席（サーバー側で自動的に意思決定する参加者）
+
+セッション設定:
+- bot_seats: セッション作成時にボットにする参加者の数（id_in_session の大きい順、既定 0）。
+  人数がグループの大きさで割り切れないときの空席を埋める。
+- bot_takeover: True にすると、意思決定ページで時間切れ（decision_timeout）になった
+  参加者を以後ボットに切り替え、グループが離脱者を待ち続けないようにする。
+
+ボットの参加者は全ページの制限時間が BOT_PAGE_SECONDS 秒になり、
+時間切れで自動的に進む。prodserver ではタイムアウトワーカーがボットのページを
+サーバー側で進めるので、リンクを開く必要はない（devserver ではボットのリンクを
+一度開くか、管理画面の "Advance slowest participants" を使う）。
+
+R&Dゲームのボットは、これまでの人間の投資枚数の分布（経験分布）から他の
+プレイヤーの合計枚数の分布を求め、最適反応表に対する期待利益が最大の枚数を選ぶ。
+"""
+import functools
+
+from rd_engine import timeouts
+from rd_engine.simulate import best_response_table
+
+BOT_PAGE_SECONDS = 1
+# タイムアウトワーカーがボットの最初のページを開くまでの秒数
+BOT_START_DELAY = 5
+
+
+def is_bot(participant):
+    return participant.vars.get('bot', False)
+
+
+def bot_mode(session):
+    """ボット席・離脱者の引き継ぎのいずれかが有効か"""
+    return bool(session.config.get('bot_seats', 0) or session.config.get('bot_takeover', False))
+
+
+def assign_bot_seats(subsession):
+    """セッション作成時に bot_seats 人をボットにし、サーバー側で開始させる"""
+    num_bots = subsession.session.config.get('bot_seats', 0)
+    if not num_bots:
+        return
+    participants = sorted(subsession.session.get_participants(), key=lambda p: p.id_in_session)
+    bots = participants[len(participants) - num_bots:]
+    for participant in bots:
+        participant.vars['bot'] = True
+
+    import otree.common
+    import otree.tasks
+
+    if otree.common.USE_TIMEOUT_WORKER:
+        otree.tasks.ensure_pages_visited(
+            delay=BOT_START_DELAY, participant_pks=[p.id for p in bots], page_index=0,
+        )
+
+
+def take_over(participant):
+    """時間切れの参加者をボットに切り替える（bot_takeover 設定時）"""
+    if participant.session.config.get('bot_takeover', False):
+        participant.vars['bot'] = True
+
+
+def page_timeout(player, key=None):
+    """ページの制限時間: ボットは即時、それ以外はセッション設定 key（秒）"""
+    if is_bot(player.participant):
+        return BOT_PAGE_SECONDS
+    if key is None:
+        return None
+    return timeouts.timeout_seconds(player.session, key)
+
+
+def record_cards(session, choices, cards_per_player):
+    """人間のプレイヤーの投資枚数を経験分布に加える（ボット設定時のみ）"""
+    if not bot_mode(session):
+        return
+    counts = list(session.vars.get('bot_card_counts') or [0] * (cards_per_player + 1))
+    for cards in choices:
+        counts[cards] += 1
+    session.vars['bot_card_counts'] = counts
+
+
+@functools.lru_cache(maxsize=None)
+def payoff_table(engine, treatment):
+    """[他プレイヤーの合計枚数][自分の枚数] → 1ラウンドの期待利益"""
+    return [[mean for mean, _ in row['values']] for row in best_response_table(engine, treatment)]
+
+
+def others_total_distribution(counts, num_others):
+    """1人あたりの枚数の分布から、num_others 人の合計枚数の分布を求める（畳み込み）"""
+    # 観測がない枚数も選ばれうるように各枚数に1を足して正規化する
+    weights = [c + 1 for c in counts]
+    total = sum(weights)
+    single = [w / total for w in weights]
+    distribution = [1.0]
+    for _ in range(num_others):
+        convolved = [0.0] * (len(distribution) + len(single) - 1)
+        for i, p in enumerate(distribution):
+            for j, q in enumerate(single):
+                convolved[i + j] += p * q
+        distribution = convolved
+    return distribution
+
+
+def bot_cards(engine, treatment, session):
+    """経験分布に対する最適反応の投資枚数（同点なら少ない方）"""
+    counts = session.vars.get('bot_card_counts') or [0] * (engine.cards_per_player + 1)
+    distribution = others_total_distribution(counts, engine.players_per_group - 1)
+    table = payoff_table(engine, treatment)
+    expected = [
+        sum(p * table[others_total][cards] for others_total, p in enumerate(distribution))
+        for cards in range(engine.cards_per_player + 1)
+    ]
+    return max(range(len(expected)), key=lambda cards: (expected[cards], -cards))
@@ -0,0 +1,252 @@
+"""
+結果の書き込みをまとめる
+
+結果の計算では各プレイヤーの participant.vars を読みながらフィールドに代入する。
+oTree の player.payoff への代入は毎回コミットし（全オブジェクトが期限切れになる）、
+さらに SQLAlchemy の autoflush で participant の遅延読み込みのたびに UPDATE が
+書き出されるため、プレイヤー数に比例して往復が増える。
+
+resolving は次の4つで、グループ・サブセッションの更新を1回の flush にまとめる。
+
+1. 参照する関連オブジェクト（participant, group）を IN 句の1回の SELECT で読み込み、
+   ブロックの間は読み込んだオブジェクトを保持する
+2. ブロック内は autoflush を止め、代入はセッションの作業単位に溜める
+   （利益は player.payoff ではなく set_payoff で溜め、ブロックの終わりに全員分を
+   executemany の UPDATE 1回で書く。player.payoff はブロックを抜けるまで古い値のまま）
+3. モデルごとに代入のあった列をそろえる（SQLAlchemy は変更された列の組が同じ行だけを
+   executemany にまとめるため、そろえないと1行ずつ UPDATE になる）
+4. ブロックの終わりに一度だけ flush する
+
+トランザクションは oTree がリクエストの終わりにコミットする。
+データベースに結び付いていないオブジェクト（rd_engine.check の Fake など）では何もしない。
+
+ベンチマーク（メモリ上の SQLite で、まとめる場合と1件ずつの場合を比較）:
+    python -m rd_engine.bulk --participants 100,500
+"""
+import argparse
+import contextlib
+import importlib
+import os
+import random
+import sys
+import time
+
+import sqlalchemy
+import sqlalchemy.orm
+
+# False にすると従来どおり代入のたびに autoflush される（ベンチマークの比較用）
+ENABLED = True
+# player.payoff の値を持つ oTree の Player の列
+PAYOFF_COLUMN = '_payoff'
+# resolving の状態を置く、データベースセッションの info のキー
+BATCH = 'rd_engine.bulk'
+
+
+def object_session(obj):
+    try:
+        return sqlalchemy.orm.object_session(obj)
+    except sqlalchemy.orm.exc.UnmappedInstanceError:
+        return None
+
+
+def preload(session, objects, relation):
+    """objects の多対一の関連 relation を1回の SELECT で読み込み、遅延読み込みを省く"""
+    mapper = sqlalchemy.inspect(type(objects[0]))
+    prop = mapper.relationships[relation]
+    (column,) = prop.local_columns
+    key = mapper.get_property_by_column(column).key
+    ids = {getattr(obj, key) for obj in objects}
+    target = prop.mapper
+    (primary_key,) = target.primary_key
+    # 読み込んだオブジェクトは識別マップに入り、obj.<relation> は SQL なしで参照できる
+    # （識別マップは弱参照なので、呼び出し側が返り値を保持する）
+    return session.query(target.class_).filter(primary_key.in_(ids)).all()
+
+
+def set_payoff(player, value):
+    """player.payoff = value と同じ更新（participant.payoff にも加算）をコミットせずに行う
+
+    resolving のブロック内では利益を溜めてブロックの終わりにまとめて書くので、
+    player.payoff はそれまで古い値を返す。呼び出し側は計算した値を使う。
+    ブロックの外では player.payoff に代入する。
+    """
+    from otree import settings
+
+    session = object_session(player)
+    batch = session.info.get(BATCH) if session is not None else None
+    if batch is None or not settings.AUTO_TABULATE_PAYOFFS:
+        player.payoff = value
+        return
+    value = value or 0
+    payoffs = batch['payoffs']
+    player.participant.payoff += value - payoffs.get(player, player.payoff)
+    payoffs[player] = value
+
+
+def write_payoffs(session, payoffs):
+    """溜めた利益を executemany の UPDATE 1回で書き、読み込み済みの player.payoff を期限切れにする"""
+    if not payoffs:
+        return
+    mapper = sqlalchemy.inspect(type(next(iter(payoffs))))
+    (primary_key,) = mapper.primary_key
+    statement = mapper.local_table.update().where(
+        primary_key == sqlalchemy.bindparam('player_id')
+    ).values({PAYOFF_COLUMN: sqlalchemy.bindparam('payoff')})
+    session.execute(statement, [
+        dict(player_id=mapper.primary_key_from_instance(player)[0], payoff=value)
+        for player, value in payoffs.items()
+    ])
+    for player in payoffs:
+        session.expire(player, [PAYOFF_COLUMN])
+
+
+def align_updates(session):
+    """代入のあった列をモデルごとにそろえ、flush の UPDATE を executemany にまとめる
+
+    flag_modified した列は flush で前の値と比べずに書くので、値の比較（participant.vars の
+    pickle など）も省ける。
+    """
+    assigned = {}
+    for obj in session.dirty:
+        state = sqlalchemy.inspect(obj)
+        assigned.setdefault(state.mapper, []).append((obj, state))
+    for mapper, rows in assigned.items():
+        columns = set().union(*(state.committed_state for _, state in rows))
+        columns &= set(mapper.column_attrs.keys())
+        for obj, state in rows:
+            for key in columns:
+                if key in state.dict:
+                    sqlalchemy.orm.attributes.flag_modified(obj, key)
+
+
+@contextlib.contextmanager
+def resolving(objects, *relations):
+    """objects の関連を先に読み込み、ブロック内の更新を最後に一度だけ書き出す"""
+    session = object_session(objects[0]) if objects and ENABLED else None
+    # 外側の resolving があればそちらでまとめて書き出す
+    if session is None or BATCH in session.info:
+        yield
+        return
+    # preloaded は識別マップからオブジェクトが消えないよう、ブロックの間保持する
+    batch = session.info[BATCH] = dict(
+        preloaded=[preload(session, objects, relation) for relation in relations],
+        payoffs={},
+    )
+    try:
+        with session.no_autoflush:
+            yield
+            write_payoffs(session, batch['payoffs'])
+            align_updates(session)
+        session.flush()
+    finally:
+        del session.info[BATCH]
+
+
+# ベンチマーク
+
+APPS = (
+    'r_and_d_game_spillover_700',
+    'two_stage_contest',
+)
+
+
+def set_decisions(module, subsession, generator):
+    """1ラウンド分の意思決定をランダムに入れる"""
+    for p in subsession.get_players():
+        if module.__name__ == 'two_stage_contest':
+            p.effort = generator.randint(0, 50)
+        else:
+            p.cards_invested = generator.randint(0, module.Constants.cards_per_player)
+
+
+def resolve(module, subsession, per_group):
+    """グループごと、またはサブセッション一括で結果を計算する"""
+    contest = module.__name__ == 'two_stage_contest'
+    if per_group:
+        for group in subsession.get_groups():
+            if contest:
+                module.set_payoffs(group)
+            else:
+                group.set_payoffs()
+    elif contest:
+        module.set_payoffs_all(subsession)
+    else:
+        subsession.set_payoffs()
+
+
+def benchmark(app, num_participants, per_group, enabled, seed=0):
+    """(秒, SQL 文の数, UPDATE 文の数) を全ラウンドの合計で返す"""
+    from sqlalchemy import event
+
+    from otree.database import db, engine, session_scope
+    from otree.models import Session
+    from otree.session import create_session
+
+    with session_scope():
+        code = create_session(app, num_participants=num_participants).code
+    statements = {'all': 0, 'update': 0, 'counting': False}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if not statements['counting']:
+            return
+        statements['all'] += 1
+        if statement.lstrip().upper().startswith('UPDATE'):
+            statements['update'] += 1
+
+    # python -m で実行するとこのモジュールは __main__ になるので、アプリが使う方を切り替える
+    target = importlib.import_module('rd_engine.bulk')
+    previous, target.ENABLED = target.ENABLED, enabled
+    module = importlib.import_module(app)
+    generator = random.Random(seed)
+    seconds = 0.0
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        with session_scope():
+            session = db.query(Session).filter_by(code=code).one()
+            num_rounds = module.Subsession.objects_filter(session=session).count()
+        for round_number in range(1, num_rounds + 1):
+            with session_scope():
+                session = db.query(Session).filter_by(code=code).one()
+                subsession = module.Subsession.objects_get(session=session, round_number=round_number)
+                set_decisions(module, subsession, generator)
+                db._db.flush()
+                statements['counting'] = True
+                start = time.perf_counter()
+                resolve(module, subsession, per_group)
+                db._db.flush()
+                seconds += time.perf_counter() - start
+                statements['counting'] = False
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+        target.ENABLED = previous
+    return seconds, statements['all'], statements['update']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='結果の書き込みをまとめた場合と1件ずつの場合を比較する')
+    parser.add_argument('--apps', default=','.join(APPS), help='セッション設定名（カンマ区切り）')
+    parser.add_argument('--participants', default='100', help='参加者数（カンマ区切り）')
+    args = parser.parse_args(argv)
+
+    # oTree の設定を読み込む前に、データベースをメモリ上にする
+    os.environ.setdefault('OTREE_IN_MEMORY', '1')
+    sys.path.insert(0, os.getcwd())
+    from otree.main import setup
+
+    setup()
+    print(f'{"アプリ":<32} {"人数":>5} {"計算単位":<10} {"方式":<8} {"秒":>8} {"SQL":>7} {"UPDATE":>7}')
+    for app in args.apps.split(','):
+        for num_participants in [int(n) for n in args.participants.split(',')]:
+            for per_group in (True, False):
+                for enabled in (False, True):
+                    seconds, num_statements, num_updates = benchmark(
+                        app, num_participants, per_group, enabled,
+                    )
+                    print(f'{app:<32} {num_participants:>5} {"グループ" if per_group else "一括":<10} '
+                          f'{"まとめる" if enabled else "1件ずつ":<8} {seconds:>8.3f} '
+                          f'{num_statements:>7} {num_updates:>7}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,365 @@
+"""
+利益計算の性質テストとマイクロベンチマーク
+
+データベースを使わない偽のグループ・プレイヤー（Fake）に対して、各アプリの
+次の関数をそのまま呼び出す。
+
+- R&Dゲーム: Group.set_payoffs, Subsession.set_payoffs,
+  Group.calculate_success_probability, Player.calculate_total_investment
+- two_stage_contest: set_payoffs, set_payoffs_all
+
+性質テストはシード付きの乱数で入力を生成し、次の不変条件を確かめる。
+失敗した場合は入力（反例）を表示する。
+
+- R&D: 利益の保存（利益の合計 = 報酬の合計 - 投資額の合計）、当選者は成功時に
+  ちょうど1人、成功確率の単調性、グループ単位と一括計算の結果の一致、
+  累積投資額・累積利益が各ラウンドの合計と一致
+- contest: 報酬の保存（報酬の合計 = 順位報酬の合計）、順位の対称性（メンバーの
+  並べ替えで結果も同じように並び替わる）、順位 = 1 + 自分より大きいエフォートの人数、
+  同じエフォートなら同じ報酬、グループ単位と一括計算の結果の一致
+
+アプリはメモリ上の oTree のデータベースで読み込むので、作業ディレクトリに
+db.sqlite3 を作らず、DATABASE_URL のデータベースにも接続しない。
+
+ベンチマークは timeit で1回あたりの処理時間（マイクロ秒）を測る。
+--save-baseline で保存した基準値と --baseline で比較し、許容幅（--tolerance）を
+超えて遅くなった関数があれば終了コード 1 を返す。
+
+使い方:
+    python -m rd_engine.check --examples 500
+    python -m rd_engine.check --benchmark --save-baseline check_baseline.json
+    python -m rd_engine.check --benchmark --baseline check_baseline.json
+"""
+import argparse
+import importlib
+import inspect
+import json
+import os
+import random
+import sys
+import tempfile
+import timeit
+import types
+
+import rd_engine
+from rd_engine import rng
+from rd_engine.replay import CONTEST_APP
+from rd_engine.simulate import PRESETS
+
+RD_APPS = sorted(PRESETS)
+# ベンチマークの繰り返し回数（最小値を採用）
+BENCHMARK_REPEAT = 5
+
+
+def load_app(name):
+    """データベースに副作用を残さずにアプリを読み込む
+
+    oTree はインポート時に作業ディレクトリの db.sqlite3 に接続し、テーブルを作るので、
+    最初の読み込みではメモリ上のデータベース（OTREE_IN_MEMORY）を使い、
+    接続だけ一時ディレクトリで開かせる。
+    """
+    if 'otree.database' not in sys.modules:
+        os.environ['OTREE_IN_MEMORY'] = '1'
+        # ディスクのデータベースの内容をメモリに読み込まない
+        os.environ['OTREE_EPHEMERAL'] = '1'
+        cwd = os.getcwd()
+        # python -m では sys.path の '' が作業ディレクトリを指すので、絶対パスにしておく
+        sys.path.insert(0, cwd)
+        with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as directory:
+            os.chdir(directory)
+            try:
+                importlib.import_module('otree.database')
+            finally:
+                os.chdir(cwd)
+    return importlib.import_module(name)
+
+
+class Fake:
+    """モデルのメソッドをそのまま使う、データベースなしのオブジェクト
+
+    属性はコンストラクタで渡し、ない属性は model クラスの関数を束縛して返す
+    （クラスメソッドはクラスに束縛したまま返す）。
+    """
+
+    def __init__(self, model=None, **fields):
+        self.__dict__['_model'] = model
+        self.__dict__.update(fields)
+
+    def __getattr__(self, name):
+        function = getattr(self._model, name, None)
+        if inspect.isfunction(function):
+            return types.MethodType(function, self)
+        if inspect.ismethod(function):
+            return function
+        raise AttributeError(name)
+
+    def field_maybe_none(self, name):
+        return self.__dict__.get(name)
+
+
+class Fixture:
+    """1セッション分の偽オブジェクト（グループは id_in_subsession 順）"""
+
+    def __init__(self, module, num_players, group_size, config=None, seed=0):
+        self.module = module
+        self.session = Fake(config=dict(config or {}), vars={}, num_participants=num_players)
+        self.participants = [
+            Fake(vars={}, id_in_session=i + 1, session=self.session) for i in range(num_players)
+        ]
+        self.subsession = Fake(getattr(module, 'Subsession'), session=self.session, round_number=1)
+        self.groups = []
+        self.players = []
+        num_groups = num_players // group_size
+        self.session.vars['rng_streams'] = rng.generate_streams(
+            seed, rd_engine.NUM_ROUNDS, num_groups,
+        )
+        for g in range(num_groups):
+            group = Fake(getattr(module, 'Group'), session=self.session, subsession=self.subsession,
+                         id_in_subsession=g + 1, round_number=1)
+            members = []
+            for i in range(group_size):
+                participant = self.participants[g * group_size + i]
+                members.append(Fake(
+                    getattr(module, 'Player'), session=self.session, subsession=self.subsession,
+                    group=group, participant=participant, id_in_group=i + 1, round_number=1,
+                    is_bot=False, timeout_happened=False,
+                ))
+            group.get_players = lambda members=members: list(members)
+            self.groups.append(group)
+            self.players.extend(members)
+        self.subsession.get_players = lambda: list(self.players)
+        self.subsession.get_groups = lambda: list(self.groups)
+
+    def set_round(self, round_number):
+        for obj in [self.subsession, *self.groups, *self.players]:
+            obj.round_number = round_number
+
+
+def rd_fixture(app, num_groups, seed):
+    return Fixture(load_app(app), num_groups * rd_engine.PLAYERS_PER_GROUP,
+                   rd_engine.PLAYERS_PER_GROUP, seed=seed)
+
+
+def contest_fixture(num_groups, group_size, seed):
+    module = load_app(CONTEST_APP)
+    return Fixture(module, num_groups * group_size, group_size,
+                   config={'players_per_group': group_size}, seed=seed)
+
+
+def expected_reward_total(engine, treatment, is_successful, group_size):
+    """成功・失敗に応じたグループの報酬の合計"""
+    if not is_successful:
+        return 0
+    losers = group_size - 1 if treatment == rd_engine.SPILL_OVER else 0
+    return engine.success_reward + losers * engine.spillover_reward
+
+
+# 性質テスト
+
+def check_rd(app, examples, generator, failures):
+    """R&Dアプリの set_payoffs と累積値の不変条件"""
+    module = load_app(app)
+    engine = module.ENGINE
+    cards_max = module.Constants.cards_per_player
+
+    # 成功確率は合計枚数について単調非減少で、テーブルと一致する
+    group = Fake(module.Group)
+    previous = 0
+    for total in range(engine.max_total_cards + 1):
+        group.total_cards_invested = total
+        probability = group.calculate_success_probability()
+        if probability < previous or probability != engine.success_probability[total]:
+            failures.append(f'{app}: 成功確率が不正です total={total} probability={probability}')
+        previous = probability
+
+    for _ in range(examples):
+        fixture = rd_fixture(app, generator.randint(1, 4), generator.randrange(2 ** 32))
+        batch = rd_fixture(app, len(fixture.groups), 0)
+        batch.session.vars['rng_streams'] = fixture.session.vars['rng_streams']
+        treatment = fixture.subsession.treatment()
+        invested_total = {p.participant.id_in_session: 0 for p in fixture.players}
+        payoff_total = dict(invested_total)
+
+        for round_number in range(1, rd_engine.NUM_ROUNDS + 1):
+            fixture.set_round(round_number)
+            batch.set_round(round_number)
+            for p, q in zip(fixture.players, batch.players):
+                p.cards_invested = q.cards_invested = generator.randint(0, cards_max)
+            for group in fixture.groups:
+                group.set_payoffs()
+            batch.subsession.set_payoffs()
+
+            for group, other in zip(fixture.groups, batch.groups):
+                players = group.get_players()
+                cards = [p.cards_invested for p in players]
+                context = f'{app} round={round_number} group={group.id_in_subsession} cards={cards}'
+                payoffs = [int(p.payoff) for p in players]
+                expected = (expected_reward_total(engine, treatment, group.is_rd_successful, len(players))
+                            - engine.card_value * sum(cards))
+                if sum(payoffs) != expected:
+                    failures.append(f'{context}: 利益の合計 {sum(payoffs)} != {expected}')
+                winners = [p.id_in_group for p in players if p.is_winner]
+                if group.is_rd_successful:
+                    if winners != [group.winner_id] or (sum(cards) and not cards[group.winner_id - 1]):
+                        failures.append(f'{context}: 当選者が不正です winners={winners}')
+                elif winners:
+                    failures.append(f'{context}: 失敗したのに当選者がいます winners={winners}')
+                batch_payoffs = [int(p.payoff) for p in other.get_players()]
+                if batch_payoffs != payoffs or other.dice_roll != group.dice_roll:
+                    failures.append(f'{context}: 一括計算の結果が異なります {batch_payoffs} != {payoffs}')
+
+            for p in fixture.players:
+                key = p.participant.id_in_session
+                invested_total[key] += p.cards_invested * engine.card_value
+                payoff_total[key] += int(p.payoff)
+                if (p.total_investment, p.cumulative_payoff) != (invested_total[key], payoff_total[key]):
+                    failures.append(
+                        f'{app} round={round_number} participant={key}: 累積値が不正です '
+                        f'({p.total_investment}, {p.cumulative_payoff}) != '
+                        f'({invested_total[key]}, {payoff_total[key]})'
+                    )
+        if len(failures) > 20:
+            return
+
+
+def check_contest(examples, generator, failures):
+    """two_stage_contest の set_payoffs の不変条件"""
+    module = load_app(CONTEST_APP)
+    for _ in range(examples):
+        group_size = generator.randint(2, 6)
+        fixture = contest_fixture(generator.randint(1, 3), group_size, 0)
+        batch = contest_fixture(len(fixture.groups), group_size, 0)
+        payoff_total = {p.participant.id_in_session: 0 for p in fixture.players}
+        for round_number in range(1, module.C.NUM_ROUNDS + 1):
+            fixture.set_round(round_number)
+            batch.set_round(round_number)
+            for p, q in zip(fixture.players, batch.players):
+                # 同点が出やすいように小さい範囲からも選ぶ
+                p.cost = q.cost = generator.randint(1, 10)
+                p.effort = q.effort = generator.randint(0, generator.choice([3, 100]))
+            for group in fixture.groups:
+                module.set_payoffs(group)
+            module.set_payoffs_all(batch.subsession)
+
+            rewards_total = sum(module.rank_rewards(round_number, group_size))
+            for group, other in zip(fixture.groups, batch.groups):
+                players = group.get_players()
+                members = [(p.effort, p.cost) for p in players]
+                context = f'{CONTEST_APP} round={round_number} members={members}'
+                results = [(p.reward, p.rank, p.tied) for p in players]
+                if abs(sum(p.reward for p in players) - rewards_total) > 1e-9:
+                    failures.append(f'{context}: 報酬の合計が {rewards_total} と一致しません {results}')
+                for p in players:
+                    higher = sum(q.effort > p.effort for q in players)
+                    equal = sum(q.effort == p.effort for q in players)
+                    if p.rank != higher + 1 or p.tied != (equal > 1):
+                        failures.append(f'{context}: 順位が不正です {results}')
+                    if p.payoff != p.reward - p.cost * p.effort:
+                        failures.append(f'{context}: 利得が不正です {p.payoff}')
+                    payoff_total[p.participant.id_in_session] += p.payoff
+                    if p.total_payoff != payoff_total[p.participant.id_in_session]:
+                        failures.append(f'{context}: 利得合計が不正です {p.total_payoff}')
+                    same = {q.reward for q in players if q.effort == p.effort}
+                    if len(same) > 1:
+                        failures.append(f'{context}: 同じエフォートで報酬が異なります {results}')
+                if [(p.reward, p.rank, p.tied) for p in other.get_players()] != results:
+                    failures.append(f'{context}: 一括計算の結果が異なります')
+
+                # メンバーを並べ替えても、各メンバーの結果は変わらない
+                order = generator.sample(range(group_size), group_size)
+                permuted = module.resolve_groups([[members[i] for i in order]], round_number)[0]
+                if [results[i] for i in order] != permuted:
+                    failures.append(f'{context}: 並べ替えで結果が変わります order={order}')
+
+        if len(failures) > 20:
+            return
+
+
+# ベンチマーク
+
+def benchmark_cases(num_groups):
+    """(名前, 1回分の処理) のリスト。入力は固定シードで作る"""
+    generator = random.Random(0)
+    cases = []
+    for app in RD_APPS:
+        fixture = rd_fixture(app, num_groups, 0)
+        for p in fixture.players:
+            p.cards_invested = generator.randint(0, rd_engine.CARDS_PER_PLAYER)
+        group = fixture.groups[0]
+        group.total_cards_invested = 10
+        player = fixture.players[0]
+        cases += [
+            (f'{app}.Group.set_payoffs', group.set_payoffs),
+            (f'{app}.Subsession.set_payoffs[{num_groups}]', fixture.subsession.set_payoffs),
+            (f'{app}.Group.calculate_success_probability', group.calculate_success_probability),
+            (f'{app}.Player.calculate_total_investment', player.calculate_total_investment),
+        ]
+    module = load_app(CONTEST_APP)
+    fixture = contest_fixture(num_groups, module.C.DEFAULT_PLAYERS_PER_GROUP, 0)
+    for p in fixture.players:
+        p.cost = generator.randint(1, 10)
+        p.effort = generator.randint(0, 50)
+    group = fixture.groups[0]
+    cases += [
+        (f'{CONTEST_APP}.set_payoffs', lambda: module.set_payoffs(group)),
+        (f'{CONTEST_APP}.set_payoffs_all[{num_groups}]',
+         lambda: module.set_payoffs_all(fixture.subsession)),
+    ]
+    return cases
+
+
+def run_benchmarks(num_groups):
+    """名前 → 1回あたりの処理時間（マイクロ秒、繰り返しの最小値）"""
+    results = {}
+    for name, function in benchmark_cases(num_groups):
+        timer = timeit.Timer(function)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=BENCHMARK_REPEAT, number=number)) / number
+        results[name] = best * 1e6
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='利益計算の性質テストとマイクロベンチマーク')
+    parser.add_argument('--examples', type=int, default=200, help='性質テストの入力の数（アプリごと）')
+    parser.add_argument('--seed', type=int, default=0, help='入力を生成する乱数のシード')
+    parser.add_argument('--benchmark', action='store_true', help='マイクロベンチマークも実行する')
+    parser.add_argument('--groups', type=int, default=25, help='一括計算のベンチマークのグループ数')
+    parser.add_argument('--baseline', help='比較する基準値の JSON')
+    parser.add_argument('--save-baseline', help='結果を基準値として保存する JSON')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='基準値からの許容幅（割合）')
+    args = parser.parse_args(argv)
+
+    failures = []
+    generator = random.Random(args.seed)
+    for app in RD_APPS:
+        check_rd(app, args.examples, generator, failures)
+    check_contest(args.examples, generator, failures)
+    print(f'性質テスト: {len(RD_APPS) + 1} アプリ × {args.examples} 件, 失敗 {len(failures)} 件')
+    for failure in failures[:20]:
+        print(f'  {failure}')
+    status = 1 if failures else 0
+
+    if args.benchmark or args.baseline or args.save_baseline:
+        results = run_benchmarks(args.groups)
+        baseline = {}
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for name, micros in results.items():
+            line = f'{name:<66} {micros:10.2f} µs'
+            reference = baseline.get(name)
+            if reference is not None:
+                line += f'  (基準値 {reference:.2f} µs)'
+                if micros > reference * (1 + args.tolerance):
+                    line += '  遅くなりました'
+                    status = 1
+            print(line)
+        if args.save_baseline:
+            with open(args.save_baseline, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+セッション結果の列指向エクスポート
+
+アプリごとの CSV エクスポートを、アプリ・セッションごとに1ファイルの
+型付き列指向形式（.rdcol）に変換する。分析時は CSV を解析し直さず、
+mmap でそのまま列を参照できる。
+
+ファイル形式（リトルエンディアン）:
+    8 バイト  マジック b'RDCOL001'
+    8 バイト  ヘッダ長 (uint64)
+    ヘッダ    JSON: app, session_code, num_rows, config, columns
+    列データ  各列を 8 バイト境界に揃えて連続配置
+
+columns の各要素は name, dtype, offset, categories を持つ。
+dtype は 'int64'（欠損は INT_NULL）, 'float64'（欠損は NaN）,
+'bool'（int8、欠損は -1）, 'category'（int32 の符号、値は categories、欠損は -1）
+のいずれかで、アプリのモデル定義から決まるためセッションをまたいで揃う。
+numpy があれば numpy.memmap(path, dtype='<i8', offset=offset, shape=(num_rows,))
+のように直接読める。
+
+使い方:
+    python -m rd_engine.columnar r_and_d_game_spillover_700.csv --out columnar/
+    python -m rd_engine.columnar --show columnar/r_and_d_game_spillover_700/abcd1234.rdcol
+"""
+import argparse
+import array
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+from collections import defaultdict
+
+import rd_engine
+from rd_engine.replay import APPS, CONTEST_APP, detect_app, load_export
+from rd_engine.simulate import PRESETS
+
+MAGIC = b'RDCOL001'
+ALIGN = 8
+INT_NULL = -(2 ** 63)
+
+# 分析に使う列（oTree 内部の列は除く）
+KEEP_PREFIXES = ('player.', 'group.', 'subsession.')
+KEEP_COLUMNS = ('session.code', 'participant.code', 'participant.id_in_session')
+
+TYPECODES = {'int64': 'q', 'float64': 'd', 'bool': 'b', 'category': 'i'}
+
+# モデルのフィールド型 → 列の型
+FIELD_DTYPES = {
+    'Integer': 'int64',
+    'Float': 'float64',
+    'CurrencyType': 'float64',
+    'Boolean': 'bool',
+    'String': 'category',
+    'Text': 'category',
+}
+
+
+def app_config(app):
+    """settings.py のセッション設定とアプリの報酬設定をまとめる"""
+    import settings
+
+    config = dict(settings.SESSION_CONFIG_DEFAULTS)
+    for session_config in settings.SESSION_CONFIGS:
+        if app in session_config['app_sequence']:
+            config.update(session_config)
+            break
+    if app == CONTEST_APP:
+        import two_stage_contest
+
+        config['REWARDS'] = two_stage_contest.C.REWARDS
+    else:
+        spillover_reward, treatment = PRESETS[app]
+        config.update(
+            success_reward=rd_engine.SUCCESS_REWARD,
+            spillover_reward=spillover_reward,
+            card_value=rd_engine.CARD_VALUE,
+            success_thresholds=[
+                [min_cards, max_cards, probability]
+                for (min_cards, max_cards), probability in rd_engine.SUCCESS_THRESHOLDS.items()
+            ],
+        )
+    return config
+
+
+def model_dtypes(app):
+    """アプリのモデル定義から 'player.payoff' → 'float64' のような型の対応を作る"""
+    import importlib
+
+    module = importlib.import_module(app)
+    dtypes = {
+        'session.code': 'category',
+        'participant.code': 'category',
+        'participant.id_in_session': 'int64',
+    }
+    for prefix, model in (('player', module.Player), ('group', module.Group),
+                          ('subsession', module.Subsession)):
+        for column in model.__table__.columns:
+            dtype = FIELD_DTYPES.get(type(column.type).__name__)
+            if dtype:
+                # payoff や role は内部では _payoff, _role という列名
+                dtypes[f'{prefix}.{column.name.lstrip("_")}'] = dtype
+    return dtypes
+
+
+def infer_dtype(values):
+    """モデルにない列は値から型を決める"""
+    present = [v for v in values if v is not None]
+    if all(isinstance(v, int) for v in present):
+        return 'int64'
+    if all(isinstance(v, (int, float)) for v in present):
+        return 'float64'
+    return 'category'
+
+
+def encode_column(values, dtype):
+    """列を (array, categories) に変換"""
+    if dtype == 'int64':
+        return array.array('q', (INT_NULL if v is None else v for v in values)), None
+    if dtype == 'float64':
+        return array.array('d', (math.nan if v is None else v for v in values)), None
+    if dtype == 'bool':
+        return array.array('b', (-1 if v is None else int(bool(v)) for v in values)), None
+    categories = sorted({str(v) for v in values if v is not None})
+    index = {value: i for i, value in enumerate(categories)}
+    return array.array('i', (-1 if v is None else index[str(v)] for v in values)), categories
+
+
+def write_table(path, app, session_code, rows, config, dtypes):
+    """1セッション分の行を列指向ファイルに書き出す"""
+    names = [
+        name for name in rows[0]
+        if name.startswith(KEEP_PREFIXES) or name in KEEP_COLUMNS
+    ]
+    columns = []
+    blocks = []
+    for name in names:
+        values = [row[name] for row in rows]
+        dtype = dtypes.get(name) or infer_dtype(values)
+        data, categories = encode_column(values, dtype)
+        columns.append(dict(name=name, dtype=dtype, categories=categories))
+        blocks.append(data.tobytes())
+
+    def padded(size):
+        return size + (-size % ALIGN)
+
+    # オフセットはヘッダ長に依存するので、ヘッダが収まるまで計算し直す
+    header_size = 0
+    while True:
+        offset = padded(len(MAGIC) + 8 + header_size)
+        for column, block in zip(columns, blocks):
+            column['offset'] = offset
+            offset += padded(len(block))
+        header = json.dumps(dict(
+            app=app, session_code=session_code, num_rows=len(rows),
+            config=config, columns=columns,
+        ), ensure_ascii=False).encode()
+        if len(header) <= header_size:
+            break
+        header_size = padded(len(header))
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', header_size))
+        f.write(header.ljust(header_size))
+        for column, block in zip(columns, blocks):
+            f.seek(column['offset'])
+            f.write(block)
+        f.truncate(offset)
+
+
+def load(path):
+    """列指向ファイルを mmap で開き、(ヘッダ, 列名 → memoryview) を返す
+
+    列はファイルを読み込まずにそのまま参照する（コピーなし）。
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} は列指向エクスポートではありません')
+    (header_size,) = struct.unpack_from('<Q', buffer, len(MAGIC))
+    start = len(MAGIC) + 8
+    header = json.loads(bytes(buffer[start:start + header_size]).rstrip())
+    view = memoryview(buffer)
+    columns = {}
+    for column in header['columns']:
+        typecode = TYPECODES[column['dtype']]
+        size = header['num_rows'] * array.array(typecode).itemsize
+        columns[column['name']] = view[column['offset']:column['offset'] + size].cast(typecode)
+    return header, columns
+
+
+def convert(path, out_dir, app=None):
+    """CSV エクスポートをセッションごとの列指向ファイルに変換し、書き出したパスを返す"""
+    app = app or detect_app(path)
+    if app is None:
+        raise ValueError(f'アプリ名を推定できません: {path}')
+    config = app_config(app)
+    dtypes = model_dtypes(app)
+    by_session = defaultdict(list)
+    for row in load_export(path):
+        by_session[row['session.code']].append(row)
+    written = []
+    for session_code, rows in sorted(by_session.items()):
+        target = os.path.join(out_dir, app, f'{session_code}.rdcol')
+        write_table(target, app, session_code, rows, config, dtypes)
+        written.append(target)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='CSV エクスポートを列指向形式に変換する')
+    parser.add_argument('paths', nargs='+', help='アプリごとの CSV エクスポート（--show 時は .rdcol）')
+    parser.add_argument('--out', default='columnar', help='出力先ディレクトリ')
+    parser.add_argument('--app', choices=APPS, help='アプリ名（省略時はファイル名から推定）')
+    parser.add_argument('--show', action='store_true', help='.rdcol ファイルの内容を表示する')
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        if args.show:
+            header, columns = load(path)
+            print(f'{path}: {header["app"]} session={header["session_code"]} '
+                  f'{header["num_rows"]} 行')
+            for column in header['columns']:
+                print(f'  {column["name"]:<40} {column["dtype"]:<9} '
+                      f'{list(columns[column["name"]][:5])}')
+        else:
+            for target in convert(path, args.out, args.app):
+                print(target)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
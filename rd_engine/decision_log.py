@@ -0,0 +1,217 @@
+"""
+意思決定のログ（バックグラウンドで追記）
+
+セッション設定 decision_log にファイル名を指定すると、各アプリの set_payoffs で
+結果を計算したグループごとに1件の記録（セッション、アプリ、ラウンド、グループ、
+意思決定、サイコロの目、当選者、利益）を追記する。拡張子が .sqlite3 / .db なら
+SQLite（WAL モード）、それ以外は JSON Lines に書き出す。
+oTree のデータベースを読み込まずに、セッションをまたいで分析に使える。
+
+書き込みは別スレッドで行い、待機ページのコールバックはキューに入れるだけで
+ファイルの入出力を待たない。記録は oTree のトランザクションがコミットされてから
+キューに入れ、ロールバックされた場合は捨てる。キューが満杯（MAX_QUEUE 件）の
+場合は記録を捨てて件数を数える（writer(path).dropped）。
+
+読み出し:
+    python -m rd_engine.decision_log decisions.sqlite3 --session abcd1234
+    sqlite3 decisions.sqlite3 "select round, json_extract(record, '$.payoffs') from decisions"
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+MAX_QUEUE = 10000
+# 1回の書き込みにまとめる最大件数
+BATCH_SIZE = 500
+SQLITE_SUFFIXES = ('.sqlite3', '.sqlite', '.db')
+STOP = None
+# コミット待ちの記録を置く、データベースセッションの info のキー
+PENDING = 'rd_engine.decision_log'
+
+SCHEMA = """
+create table if not exists decisions (
+    id integer primary key,
+    logged_at real not null,
+    session text not null,
+    app text not null,
+    round integer not null,
+    group_index integer not null,
+    record text not null
+);
+create index if not exists decisions_session_round on decisions (session, round);
+"""
+
+_lock = threading.Lock()
+_writers = {}
+_listening = False
+
+
+def is_sqlite(path):
+    return path.endswith(SQLITE_SUFFIXES)
+
+
+class Writer:
+    """キューの記録をまとめてファイルに追記するスレッド"""
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.Queue(maxsize=MAX_QUEUE)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name=f'decision_log:{path}', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        connection = self.connect() if is_sqlite(self.path) else None
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = STOP in batch
+            records = [record for record in batch if record is not STOP]
+            if records:
+                if connection is not None:
+                    self.write_sqlite(connection, records)
+                else:
+                    self.write_jsonl(records)
+            if stop:
+                if connection is not None:
+                    connection.close()
+                return
+
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path)
+        connection.execute('pragma journal_mode=wal')
+        connection.executescript(SCHEMA)
+        return connection
+
+    def write_sqlite(self, connection, records):
+        with connection:
+            connection.executemany(
+                'insert into decisions (logged_at, session, app, round, group_index, record) '
+                'values (?, ?, ?, ?, ?, ?)',
+                [
+                    (r['logged_at'], r['session'], r['app'], r['round'], r['group'],
+                     json.dumps(r, ensure_ascii=False))
+                    for r in records
+                ],
+            )
+
+    def write_jsonl(self, records):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records))
+
+    def close(self, timeout=5):
+        """残りの記録を書き出して終了する（プロセス終了時）"""
+        if self.thread.is_alive():
+            self.queue.put(STOP)
+            self.thread.join(timeout)
+
+
+def writer(path):
+    with _lock:
+        if path not in _writers:
+            _writers[path] = Writer(path)
+        return _writers[path]
+
+
+def _after_commit(db_session):
+    for path, entry in db_session.info.pop(PENDING, ()):
+        writer(path).put(entry)
+
+
+def _after_rollback(db_session):
+    db_session.info.pop(PENDING, None)
+
+
+def _pending():
+    """現在のデータベースセッションのコミット待ちの記録（セッションの外では None）"""
+    global _listening
+    from sqlalchemy import event
+    from otree.database import DBSession, db
+
+    with _lock:
+        if not _listening:
+            event.listen(DBSession, 'after_commit', _after_commit)
+            event.listen(DBSession, 'after_rollback', _after_rollback)
+            _listening = True
+    db_session = db._db
+    if db_session is None:
+        return None
+    return db_session.info.setdefault(PENDING, [])
+
+
+def record(session, app, round_number, group_index, decisions, payoffs, dice=None, winner=None):
+    """解決したグループの記録をコミット後にキューに入れる（decision_log 未設定なら何もしない）"""
+    path = session.config.get('decision_log')
+    if not path:
+        return
+    entry = dict(
+        logged_at=time.time(),
+        session=session.code,
+        app=app,
+        round=round_number,
+        group=group_index,
+        decisions=decisions,
+        dice=dice,
+        winner=winner,
+        payoffs=[float(payoff) for payoff in payoffs],
+    )
+    pending = _pending()
+    if pending is None:
+        writer(path).put(entry)
+    else:
+        pending.append((path, entry))
+
+
+def read(path):
+    """記録を古い順に返す"""
+    if is_sqlite(path):
+        connection = sqlite3.connect(path)
+        try:
+            for (text,) in connection.execute('select record from decisions order by id'):
+                yield json.loads(text)
+        finally:
+            connection.close()
+    else:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='意思決定のログを JSON Lines で表示する')
+    parser.add_argument('path', help='decision_log に指定したファイル')
+    parser.add_argument('--session', help='セッションコードで絞り込む')
+    parser.add_argument('--app', help='アプリ名で絞り込む')
+    args = parser.parse_args(argv)
+
+    for entry in read(args.path):
+        if args.session and entry['session'] != args.session:
+            continue
+        if args.app and entry['app'] != args.app:
+            continue
+        print(json.dumps(entry, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,466 @@
+"""
+R&D投資ゲームのモデルとページ（3アプリ共通）
+
+各アプリの __init__.py は Constants と ENGINE、データベースのフィールドだけを定義し、
+メソッドとページはここのクラスを継承する。アプリごとの値（Constants, ENGINE,
+アプリ名）は app() でそのアプリのモジュールから読む。
+
+アプリごとの Constants には共通の値に加えて次を定義する。
+- spillover_reward: SpillOver条件での落選時の報酬（億円）
+- treatment: セッション設定が True のときの処遇条件（rd_engine.SPILL_OVER など）。
+  設定名・参加者変数名は rd_engine.TREATMENT_NAMES の名前（spill_over など）
+"""
+from otree.api import Page, WaitPage
+
+import rd_engine
+from rd_engine import bots, bulk, decision_log, matching, report, rng, timeouts
+
+# 管理画面の累積利益の分布の階級の幅（億円）
+REPORT_BIN_WIDTH = 500
+
+
+def app(obj):
+    """モデル（またはページに渡されたプレイヤー）が属するアプリのモジュール"""
+    return obj.get_user_defined_target()
+
+
+def treatment_name(obj):
+    """処遇条件を切り替えるセッション設定・参加者変数の名前"""
+    treatment = app(obj).Constants.treatment
+    return next(name for name, value in rd_engine.TREATMENT_NAMES.items() if value == treatment)
+
+
+def treatment_flag(player):
+    """テンプレート用の {'is_spill_over': ...} など"""
+    name = treatment_name(player)
+    return {f'is_{name}': player.participant.vars.get(name, True)}
+
+
+class Subsession:
+    def creating_session(self):
+        C = app(self).Constants
+        # セッションの設定を取得し各プレイヤーの参加者変数に保存
+        name = treatment_name(self)
+        flag = self.session.config.get(name, True)
+        for p in self.get_players():
+            p.participant.vars[name] = flag
+
+        # 全ラウンド・全グループ分のサイコロと抽選の乱数を事前に生成
+        seed = rng.session_seed(self.session)
+        self.random_seed = str(seed)
+        if self.round_number == 1:
+            bots.assign_bot_seats(self)
+            num_groups = self.session.num_participants // C.players_per_group
+            self.session.vars['rng_streams'] = rng.generate_streams(seed, C.num_rounds, num_groups)
+
+        # 到着順でなければ、全ラウンド分のグループ分けを事前に生成して適用
+        if not matching.by_arrival(self.session):
+            if self.round_number == 1:
+                self.session.vars['matching_schedule'] = matching.build_schedule(
+                    len(self.get_players()), C.players_per_group, C.num_rounds,
+                    matching.matching_mode(self.session), rng.seeded_random(seed, 'matching'),
+                )
+            matching.apply_schedule(self, self.session.vars['matching_schedule'])
+
+    def group_draws(self, groups):
+        """事前生成した乱数からグループごとの (サイコロの目, 一様乱数) を取り出す"""
+        streams = self.session.vars.get('rng_streams')
+        for g in groups:
+            g.draw_index = matching.draw_index(self, g)
+        return [rng.stream_draw(streams, self.round_number, g.draw_index) for g in groups]
+
+    def treatment(self):
+        """セッション設定から処遇条件を判定"""
+        treatment = app(self).Constants.treatment
+        if self.session.config.get(treatment_name(self), True):
+            return treatment
+        return next(t for t in rd_engine.TREATMENTS if t != treatment)
+
+    def set_payoffs(self):
+        """サブセッション内の全グループの結果を一括で計算"""
+        # 全プレイヤーを一度だけ取得し、グループごとに投資額の行列を作る
+        players = self.get_players()
+        # グループと参加者をまとめて読み込み、全グループの更新を最後に一度だけ書き出す
+        with bulk.resolving(players, 'group', 'participant'):
+            players_by_group = {}
+            for p in players:
+                players_by_group.setdefault(p.group, []).append(p)
+            for group_players in players_by_group.values():
+                group_players.sort(key=lambda p: p.id_in_group)
+            groups = list(players_by_group)
+            investments = [[p.cards_invested for p in players_by_group[g]] for g in groups]
+
+            results = app(self).ENGINE.resolve(investments, self.treatment(), self.group_draws(groups))
+
+            # 計算結果をまとめて書き戻す
+            for group, result in zip(groups, results):
+                group.apply_result(players_by_group[group], result)
+
+    def vars_for_admin_report(self):
+        """管理画面のレポート（set_payoffs で加算した集計を読むだけ）"""
+        subsessions = self.in_rounds(1, app(self).Constants.num_rounds)
+        return report.rd_vars(subsessions, self.round_number, REPORT_BIN_WIDTH)
+
+
+def creating_session(subsession):
+    # __init__.py 形式のアプリでは oTree はモジュールの creating_session を呼ぶ
+    subsession.creating_session()
+
+
+def vars_for_admin_report(subsession):
+    return subsession.vars_for_admin_report()
+
+
+def group_by_arrival_time_method(subsession, waiting_players):
+    return matching.arrival_group(subsession, waiting_players, rd_engine.PLAYERS_PER_GROUP)
+
+
+class Group:
+    def calculate_success_probability(self):
+        """カードの合計枚数に基づいて成功確率を計算"""
+        return app(self).ENGINE.success_probability[self.total_cards_invested]
+
+    def set_payoffs(self):
+        players = self.get_players()
+        result = app(self).ENGINE.resolve(
+            [[p.cards_invested for p in players]],
+            self.subsession.treatment(),
+            self.subsession.group_draws([self]),
+        )[0]
+        with bulk.resolving(players, 'participant'):
+            self.apply_result(players, result)
+
+    def apply_result(self, players, result):
+        """計算済みの結果をグループと各プレイヤーに書き込む"""
+        self.total_cards_invested = result['total_cards_invested']
+        self.success_probability = result['success_probability']
+        self.dice_roll = result['dice_roll']
+        self.is_rd_successful = result['is_rd_successful']
+        self.success_percent = int(result['success_probability'] * 100)
+        if result['is_rd_successful']:
+            self.successful_player = result['successful_player']
+            self.winner_id = result['successful_player'] + 1
+
+        # ボットの最適反応に使う経験分布には人間の選択だけを加える
+        bots.record_cards(
+            self.session,
+            [p.cards_invested for p in players if not (p.is_bot or p.timeout_happened)],
+            rd_engine.CARDS_PER_PLAYER,
+        )
+        # 分析用の意思決定ログ（設定時のみ、書き込みは別スレッド）
+        decision_log.record(
+            self.session, app(self).__name__, self.round_number, self.id_in_subsession,
+            [p.cards_invested for p in players], result['payoffs'],
+            dice=result['dice_roll'], winner=self.field_maybe_none('winner_id'),
+        )
+        for i, (player, payoff) in enumerate(zip(players, result['payoffs'])):
+            player.is_winner = result['is_rd_successful'] and i == result['successful_player']
+            # 累積投資額も計算（参照用）
+            player.calculate_total_investment()
+            bulk.set_payoff(player, payoff)
+            # プレイヤーの累積値を更新（player.payoff は書き出しまで古い値なので計算した値を渡す）
+            player.update_cumulative_payoff(payoff)
+            # 時間切れ時の自動決定（repeat / best_response）用に今回の選択を持ち越す
+            player.participant.vars['last_cards'] = player.cards_invested
+            player.participant.vars['last_others_total'] = result['total_cards_invested'] - player.cards_invested
+        # 管理画面のレポート用の集計に加える（前ラウンドまでの累積利益の階級から移す）
+        report.record_group(
+            self.subsession,
+            dict(
+                groups=1,
+                players=len(players),
+                cards=result['total_cards_invested'],
+                successes=int(result['is_rd_successful']),
+                payoff=sum(int(payoff) for payoff in result['payoffs']),
+            ),
+            [
+                (p.cumulative_payoff - int(payoff) if self.round_number > 1 else None, p.cumulative_payoff)
+                for p, payoff in zip(players, result['payoffs'])
+            ],
+            REPORT_BIN_WIDTH,
+        )
+
+
+class Player:
+    def auto_invest(self):
+        """時間切れのプレイヤーの投資額を決める
+
+        ボット席は経験分布への最適反応、それ以外はセッション設定 timeout_policy に従う。
+        """
+        engine = app(self).ENGINE
+        if bots.is_bot(self.participant):
+            self.cards_invested = bots.bot_cards(engine, self.subsession.treatment(), self.session)
+            self.is_bot = True
+            return
+        self.cards_invested = timeouts.auto_cards(self, engine, self.subsession.treatment())
+        self.timeout_happened = True
+        # bot_takeover 設定時は、以後のラウンドをボットが引き継ぐ
+        bots.take_over(self.participant)
+
+    def calculate_total_investment(self):
+        """前ラウンドまでの累積投資額に今回の投資額を加算"""
+        # 累積値は参加者変数に持ち越し、過去ラウンドを読み直さない
+        previous = self.participant.vars.get('total_investment', 0) if self.round_number > 1 else 0
+        # 今回の投資額（カード枚数 * カード価値）を加算
+        self.total_investment = previous + self.cards_invested * rd_engine.CARD_VALUE
+        self.participant.vars['total_investment'] = self.total_investment
+
+    def update_cumulative_payoff(self, payoff):
+        """前ラウンドまでの累積利益に今回の利益 payoff を加算"""
+        previous = self.participant.vars.get('cumulative_payoff', 0) if self.round_number > 1 else 0
+        # payoffをint型に変換して追加
+        self.cumulative_payoff = previous + int(payoff)
+        self.participant.vars['cumulative_payoff'] = self.cumulative_payoff
+
+    def live_result(self):
+        """ライブモードで送る結果（Results ページと同じ内容）"""
+        return {
+            'type': 'result',
+            'total_cards': self.group.total_cards_invested,
+            'success_probability': self.group.success_percent,
+            'dice_roll': self.group.dice_roll,
+            'is_successful': self.group.is_rd_successful,
+            'successful_player_id': self.group.field_maybe_none('winner_id'),
+            'is_winner': self.is_winner,
+            'cards_invested': self.cards_invested,
+            'payoff': int(self.payoff),
+            'total_investment': self.total_investment,
+            'cumulative_payoff': self.cumulative_payoff,
+        }
+
+
+GROUP_EXPORT_FIELDS = [
+    'total_cards_invested', 'success_probability', 'dice_roll', 'is_rd_successful', 'successful_player',
+    'draw_index',
+]
+
+
+def custom_export(players):
+    """1プレイヤー・1ラウンドにつき1行、グループの結果と累積値を付けて書き出す"""
+    # oTree がグループ・セッション・参加者を結合して読み込むので、
+    # 行ごとに追加のクエリ（in_round など）は発生しない
+    treatment_names = {value: name for name, value in rd_engine.TREATMENT_NAMES.items()}
+    yield [
+        'session_code', 'round_number', 'participant_code', 'group', 'id_in_group',
+        'treatment', 'cards_invested', 'payoff', 'total_investment', 'cumulative_payoff',
+        *GROUP_EXPORT_FIELDS,
+    ]
+    for p in players:
+        group = p.group
+        yield [
+            p.session.code, p.round_number, p.participant.code, group.id_in_subsession, p.id_in_group,
+            treatment_names[p.subsession.treatment()], p.cards_invested, p.payoff,
+            p.total_investment, p.cumulative_payoff,
+            # 未解決のグループや不成功時の当選者は空欄
+            *[group.field_maybe_none(name) for name in GROUP_EXPORT_FIELDS],
+        ]
+
+
+# ページ定義（各アプリで同じ名前のクラスに継承して page_sequence に並べる）
+class ArrivalWaitPage(WaitPage):
+    """到着した順にグループを作る（セッション設定 group_by_arrival_time）"""
+    group_by_arrival_time = True
+
+    def is_displayed(self):
+        return matching.regroups_on_arrival(self.session, self.round_number)
+
+
+class Introduction(Page):
+    """ゲームの説明ページ"""
+    def is_displayed(self):
+        return self.round_number == 1
+
+    def get_timeout_seconds(self):
+        return bots.page_timeout(self)
+
+    def vars_for_template(self):
+        return dict(
+            treatment_flag(self),
+            success_reward=rd_engine.SUCCESS_REWARD,
+            spillover_reward=app(self).Constants.spillover_reward,
+            card_value=rd_engine.CARD_VALUE,
+            cards_per_player=rd_engine.CARDS_PER_PLAYER,
+        )
+
+
+def is_live(obj):
+    """セッション設定 live_investment が有効ならライブモード"""
+    return obj.session.config.get('live_investment', False)
+
+
+class Investment(Page):
+    """投資額を決定するページ"""
+    form_model = 'player'
+    form_fields = ['cards_invested']
+
+    def is_displayed(self):
+        return not is_live(self)
+
+    def get_timeout_seconds(self):
+        return bots.page_timeout(self, 'decision_timeout')
+
+    def before_next_page(self, timeout_happened=False):
+        if timeout_happened:
+            self.auto_invest()
+
+    def vars_for_template(self):
+        return dict(
+            treatment_flag(self),
+            round_number=self.round_number,
+            total_investment=self.participant.vars.get('total_investment', 0) if self.round_number > 1 else 0,
+            cumulative_payoff=self.participant.vars.get('cumulative_payoff', 0) if self.round_number > 1 else 0,
+        )
+
+    def js_vars(self):
+        # 期待利益の計算機用の表（サーバーに問い合わせずにページ内で計算する）
+        return {
+            'preview': app(self).ENGINE.preview_tables[self.subsession.treatment()],
+            # 他のプレイヤーの投資枚数の合計の初期値（前ラウンドの実績）
+            'others_total': self.participant.vars.get('last_others_total') if self.round_number > 1 else None,
+        }
+
+
+class LiveInvestment(Page):
+    """ライブモード: 投資の送信から結果の表示までをページの再読み込みなしで行う
+
+    投資額は live_method で送信し、グループ最後の1人が送信した時点で
+    グループの結果を計算して全員に送る。待機ページは使わない。
+    """
+    def is_displayed(self):
+        return is_live(self)
+
+    def get_timeout_seconds(self):
+        return bots.page_timeout(self, 'decision_timeout')
+
+    def vars_for_template(self):
+        return dict(
+            Investment.vars_for_template(self),
+            card_choices=list(range(rd_engine.CARDS_PER_PLAYER + 1)),
+        )
+
+    def js_vars(self):
+        # 時間切れやボットの自動決定で結果が決まったときのために、待機中は状態を確認し直す
+        return dict(
+            Investment.js_vars(self),
+            poll=bool(timeouts.timeout_seconds(self.session, 'decision_timeout')) or bots.bot_mode(self.session),
+        )
+
+    def before_next_page(self, timeout_happened=False):
+        if not timeout_happened:
+            return
+        # 時間切れの場合、結果はこのページでは届かないので Results ページで表示する
+        self.participant.vars['live_timeout_round'] = self.round_number
+        if self.field_maybe_none('cards_invested') is None:
+            self.auto_invest()
+        group = self.group
+        players = group.get_players()
+        if group.field_maybe_none('total_cards_invested') is None and all(
+            p.field_maybe_none('cards_invested') is not None for p in players
+        ):
+            group.set_payoffs()
+
+    def live_method(self, data):
+        group = self.group
+        resolved = group.field_maybe_none('total_cards_invested') is not None
+        if data.get('type') == 'invest' and not resolved:
+            cards = data.get('cards_invested')
+            # JSON の true/false は bool になり、bool は int のサブクラスなので型そのもので判定する
+            if type(cards) is not int or isinstance(cards, bool) or not 0 <= cards <= rd_engine.CARDS_PER_PLAYER:
+                return {self.id_in_group: {'type': 'error', 'message': f'0〜{rd_engine.CARDS_PER_PLAYER}枚で選択してください'}}
+            self.cards_invested = cards
+            players = group.get_players()
+            submitted = sum(p.field_maybe_none('cards_invested') is not None for p in players)
+            if submitted < len(players):
+                # 提出状況だけをグループ全員に知らせる
+                return {0: {'type': 'status', 'submitted': submitted, 'players': len(players)}}
+            # 最後の1人が送信した時点で結果を計算し、全員に送る
+            group.set_payoffs()
+            return {p.id_in_group: p.live_result() for p in players}
+
+        # ページの読み込み・再接続時は現在の状態を本人にだけ返す
+        if resolved:
+            return {self.id_in_group: self.live_result()}
+        players = group.get_players()
+        return {self.id_in_group: {
+            'type': 'status',
+            'submitted': sum(p.field_maybe_none('cards_invested') is not None for p in players),
+            'players': len(players),
+            'cards_invested': self.field_maybe_none('cards_invested'),
+        }}
+
+
+class WaitForAll(WaitPage):
+    """全員の投資決定を待つ"""
+    def is_displayed(self):
+        return not is_live(self)
+
+
+class ResultsWaitPage(WaitPage):
+    """結果を計算"""
+    def is_displayed(self):
+        if is_live(self):
+            # ライブモードでは時間切れで結果が未計算のグループだけが待つ
+            return self.group.field_maybe_none('total_cards_invested') is None
+        return not self.session.config.get('wait_for_all_groups', False)
+
+    def after_all_players_arrive(self):
+        if self.group.field_maybe_none('total_cards_invested') is None:
+            self.group.set_payoffs()
+
+
+class AllGroupsResultsWaitPage(WaitPage):
+    """全グループの到着を待ち、結果を一括で計算"""
+    wait_for_all_groups = True
+
+    def is_displayed(self):
+        return not is_live(self) and self.session.config.get('wait_for_all_groups', False)
+
+    def after_all_players_arrive(self):
+        self.subsession.set_payoffs()
+
+
+class Results(Page):
+    """結果表示ページ"""
+    def is_displayed(self):
+        # ライブモードでは LiveInvestment ページ上に結果を表示する（時間切れの場合を除く）
+        return not is_live(self) or self.participant.vars.get('live_timeout_round') == self.round_number
+
+    def get_timeout_seconds(self):
+        return bots.page_timeout(self, 'results_timeout')
+
+    def vars_for_template(self):
+        # 保存済みのフィールドだけで表示し、計算や他ラウンドの読み込みはしない
+        return dict(
+            treatment_flag(self),
+            round_number=self.round_number,
+            total_cards=self.group.total_cards_invested,
+            success_probability=self.group.success_percent,
+            dice_roll=self.group.dice_roll,
+            is_successful=self.group.is_rd_successful,
+            successful_player_id=self.group.field_maybe_none('winner_id'),
+            is_winner=self.is_winner,
+            payoff=self.payoff,
+            total_investment=self.total_investment,
+            cumulative_payoff=self.cumulative_payoff,
+            success_reward=rd_engine.SUCCESS_REWARD,
+            spillover_reward=app(self).Constants.spillover_reward,
+            cards_invested=self.cards_invested,
+        )
+
+
+class FinalResults(Page):
+    """最終結果表示ページ"""
+    def is_displayed(self):
+        # 最終ラウンドまたはR&Dが成功したら表示
+        return self.round_number == rd_engine.NUM_ROUNDS
+
+    def get_timeout_seconds(self):
+        return bots.page_timeout(self)
+
+    def vars_for_template(self):
+        return dict(
+            treatment_flag(self),
+            cumulative_payoff=self.cumulative_payoff,
+            final_payoff=self.payoff,
+            total_investment=self.total_investment,
+        )
@@ -0,0 +1,390 @@
+"""
+ページ・コールバックの計測（処理時間のメトリクス、ベンチマーク用の記録、プロファイル）
+
+各アプリの末尾で instrument(__name__) を呼ぶと、次の関数を計測用に一度だけ包む。
+
+- ページの vars_for_template, is_displayed, before_next_page,
+  after_all_players_arrive, live_method
+- creating_session, set_payoffs（Group / Subsession のメソッドとモジュールの関数）,
+  set_payoffs_all
+
+包んだ関数は、有効になっている計測をまとめて行う。どれも有効でない関数は包まないので、
+通常の実行には影響しない。
+
+1. メトリクス（環境変数 RD_METRICS_PORT / RD_METRICS_FILE）
+   処理時間をアプリ・ページ・コールバック・ラウンド・セッションコードごとの
+   ヒストグラム（rd_callback_seconds、呼び出し回数は _count）として集計し、
+   Prometheus のテキスト形式で出力する。
+   - RD_METRICS_PORT: 127.0.0.1 のこのポートで /metrics を公開する
+   - RD_METRICS_FILE: FLUSH_SECONDS 秒ごと（と終了時）にこのファイルへ書き出す
+
+2. 結果の計算の処理時間の記録（環境変数 RD_BENCH_TIMINGS）
+   after_all_players_arrive とモジュールの set_payoffs / set_payoffs_all の処理時間を
+   このファイルに1行1件の JSON で追記する（負荷試験 rd_engine.bench が読む）。
+
+3. プロファイル（セッション設定 profile_callbacks=True）
+   結果の計算と creating_session を cProfile で計測し、呼び出しごとに
+   profile_dir（既定 "profiles"）/<セッションコード>/ に
+   <アプリ>.<ページ>.<関数>.r<ラウンド>.<グループ>.prof として保存する。
+
+集計結果は遅い順に表示できる:
+    RD_METRICS_PORT=9464 otree prodserver
+    python -m rd_engine.instrumentation metrics http://127.0.0.1:9464/metrics --top 10
+    python -m rd_engine.instrumentation metrics metrics.prom --by round
+    python -m rd_engine.instrumentation profiles profiles/abcd1234 --top 25
+    python -m rd_engine.instrumentation profiles profiles/abcd1234 --match after_all_players_arrive --out merged.prof
+"""
+import argparse
+import atexit
+import cProfile
+import functools
+import glob
+import http.server
+import inspect
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import urllib.request
+
+PORT_ENV = 'RD_METRICS_PORT'
+FILE_ENV = 'RD_METRICS_FILE'
+TIMINGS_ENV = 'RD_BENCH_TIMINGS'
+METRIC = 'rd_callback_seconds'
+LABELS = ('app', 'page', 'callback', 'round', 'session')
+# ヒストグラムの区切り（秒）
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_SECONDS = 5
+DEFAULT_PROFILE_DIR = 'profiles'
+
+PAGE_CALLBACKS = (
+    'vars_for_template', 'is_displayed', 'before_next_page', 'after_all_players_arrive', 'live_method',
+)
+MODULE_CALLBACKS = ('creating_session', 'set_payoffs', 'set_payoffs_all')
+MODEL_CALLBACKS = ('set_payoffs',)
+# 結果の計算（ページとモジュールのもの。モデルのメソッドはこの中から呼ばれる）
+RESULT_CALLBACKS = ('after_all_players_arrive', 'set_payoffs', 'set_payoffs_all')
+# profile_callbacks で計測する関数
+PROFILED_CALLBACKS = RESULT_CALLBACKS + ('creating_session',)
+
+_lock = threading.Lock()
+# ラベルの組 → [区切りごとの件数..., 合計件数, 合計秒数]
+_series = {}
+_started = False
+_local = threading.local()
+
+
+def metrics_enabled():
+    return bool(os.environ.get(PORT_ENV) or os.environ.get(FILE_ENV))
+
+
+def profiling_enabled(session):
+    return bool(session is not None and session.config.get('profile_callbacks', False))
+
+
+# メトリクス
+
+def observe(labels, seconds):
+    with _lock:
+        series = _series.get(labels)
+        if series is None:
+            series = _series[labels] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += seconds
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    """Prometheus のテキスト形式で全系列を出力"""
+    with _lock:
+        snapshot = {labels: list(series) for labels, series in _series.items()}
+    lines = [
+        f'# HELP {METRIC} Time spent in oTree page callbacks and payoff functions.',
+        f'# TYPE {METRIC} histogram',
+    ]
+    for labels, series in sorted(snapshot.items()):
+        tags = ','.join(f'{name}="{escape(value)}"' for name, value in zip(LABELS, labels))
+        for bound, count in zip(BUCKETS, series):
+            lines.append(f'{METRIC}_bucket{{{tags},le="{bound}"}} {count}')
+        lines.append(f'{METRIC}_bucket{{{tags},le="+Inf"}} {series[-2]}')
+        lines.append(f'{METRIC}_sum{{{tags}}} {series[-1]:.6f}')
+        lines.append(f'{METRIC}_count{{{tags}}} {series[-2]}')
+    return '\n'.join(lines) + '\n'
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_file(path):
+    """一時ファイルに書いてから置き換え、読み手が途中の内容を見ないようにする"""
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        f.write(render())
+    os.replace(temporary, path)
+
+
+def flush_loop(path):
+    while True:
+        time.sleep(FLUSH_SECONDS)
+        write_file(path)
+
+
+def start():
+    """公開用のサーバー・書き出し用のスレッドを一度だけ起動"""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    port = os.environ.get(PORT_ENV)
+    if port:
+        try:
+            server = http.server.ThreadingHTTPServer(('127.0.0.1', int(port)), Handler)
+        except OSError as error:
+            # 同じ環境変数のまま otree の別コマンドを実行した場合など
+            print(f'rd_engine.instrumentation: ポート {port} を使えません: {error}', file=sys.stderr)
+        else:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+    path = os.environ.get(FILE_ENV)
+    if path:
+        threading.Thread(target=flush_loop, args=(path,), daemon=True).start()
+        atexit.register(write_file, path)
+
+
+# 結果の計算の処理時間の記録
+
+def append_timing(path, label, seconds):
+    with _lock, open(path, 'a') as f:
+        f.write(json.dumps({'label': label, 'seconds': seconds}) + '\n')
+
+
+def read_timings(path):
+    """append_timing で記録した処理時間（秒）のリスト"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line)['seconds'] for line in f if line.strip()]
+
+
+# プロファイル
+
+def group_part(obj):
+    """ファイル名のグループの部分（サブセッション単位の計算は all）"""
+    if hasattr(obj, 'get_groups') or getattr(obj, 'wait_for_all_groups', False):
+        return 'all'
+    # グループそのもの、またはグループ単位の待機ページ
+    group = obj if hasattr(obj, 'get_player_by_id') else obj.group
+    return f'g{group.id_in_subsession}'
+
+
+def dump_path(obj, label):
+    """保存先のファイル名（同じグループ・ラウンドの再計算は番号を付けて残す）"""
+    session = obj.session
+    directory = os.path.join(session.config.get('profile_dir') or DEFAULT_PROFILE_DIR, session.code)
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f'{label}.r{obj.round_number}.{group_part(obj)}')
+    path, n = f'{base}.prof', 1
+    while os.path.exists(path):
+        n += 1
+        path = f'{base}.{n}.prof'
+    return path
+
+
+# 関数を包む
+
+def context(obj):
+    """コールバックの第1引数（player, group, subsession, ページ）から (ラウンド, セッションコード)"""
+    session = getattr(obj, 'session', None)
+    return str(getattr(obj, 'round_number', '')), str(getattr(session, 'code', ''))
+
+
+def wrap(function, app, page, callback, metrics=False, timings=None, profiled=False):
+    """有効な計測をまとめて行う関数で包む
+
+    timings は処理時間を追記するファイル、profiled は profile_callbacks の
+    セッションで cProfile を使うか。
+    """
+    label = '.'.join(part for part in (app, page, callback) if part)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        obj = args[0] if args else next(iter(kwargs.values()), None)
+        # 計測中の関数から呼ばれた場合は外側のプロファイルに含める
+        profile = None
+        if profiled and not getattr(_local, 'profiling', False) and profiling_enabled(getattr(obj, 'session', None)):
+            profile = cProfile.Profile()
+            _local.profiling = True
+        start = time.perf_counter()
+        try:
+            if profile is not None:
+                return profile.runcall(function, *args, **kwargs)
+            return function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            if profile is not None:
+                _local.profiling = False
+                profile.dump_stats(dump_path(obj, label))
+            if metrics:
+                observe((app, page, callback, *context(obj)), seconds)
+            if timings:
+                append_timing(timings, label, seconds)
+
+    return wrapper
+
+
+def wrap_attribute(owner, name, app, page, result=False):
+    """クラスまたはモジュールの関数（staticmethod を含む）を包んで置き換える
+
+    クラスの場合は継承したメソッド（rd_engine.game の共通のページなど）も包み、
+    包んだ関数は owner 自身に設定する（他のアプリのクラスには影響しない）。
+    result はページ・モジュールの結果の計算で、処理時間の記録とプロファイルの対象にする。
+    """
+    owners = inspect.getmro(owner) if inspect.isclass(owner) else (owner,)
+    defined_in = next((cls for cls in owners if name in vars(cls)), None)
+    if defined_in is None:
+        return
+    attribute = vars(defined_in)[name]
+    # oTree の WaitPage の既定の after_all_players_arrive などは結果の計算ではない
+    result = result and not getattr(defined_in, '__module__', '').startswith('otree.')
+    options = dict(
+        metrics=metrics_enabled(),
+        timings=os.environ.get(TIMINGS_ENV) if result and name in RESULT_CALLBACKS else None,
+        profiled=result and name in PROFILED_CALLBACKS,
+    )
+    if not any(options.values()):
+        return
+    if isinstance(attribute, staticmethod):
+        setattr(owner, name, staticmethod(wrap(attribute.__func__, app, page, name, **options)))
+    elif inspect.isfunction(attribute):
+        setattr(owner, name, wrap(attribute, app, page, name, **options))
+
+
+def instrument(module_name):
+    """アプリのコールバックを計測用に包む"""
+    module = sys.modules[module_name]
+    app = module_name
+    for name in MODULE_CALLBACKS:
+        wrap_attribute(module, name, app, '', result=True)
+    for model in (module.Subsession, module.Group):
+        for name in MODEL_CALLBACKS:
+            wrap_attribute(model, name, app, model.__name__)
+    for page in module.page_sequence:
+        for name in PAGE_CALLBACKS:
+            wrap_attribute(page, name, app, page.__name__, result=True)
+    if metrics_enabled():
+        start()
+
+
+# 集計結果の表示
+
+SAMPLE = re.compile(rf'^{METRIC}_(sum|count)\{{(.*)\}} (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse(text):
+    """Prometheus のテキストから ラベルの辞書 → {'sum': 秒, 'count': 回数}"""
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if not match:
+            continue
+        kind, tags, value = match.groups()
+        labels = tuple(LABEL.findall(tags))
+        samples.setdefault(labels, {})[kind] = float(value)
+    return samples
+
+
+def show_metrics(args):
+    if args.source.startswith(('http://', 'https://')):
+        with urllib.request.urlopen(args.source) as response:
+            text = response.read().decode()
+    else:
+        with open(args.source) as f:
+            text = f.read()
+
+    keep = {'callback': 3, 'round': 4, 'session': 5}[args.by]
+    totals = {}
+    for labels, sample in parse(text).items():
+        key = tuple(value for _, value in labels[:keep])
+        total = totals.setdefault(key, [0, 0.0])
+        total[0] += sample.get('count', 0)
+        total[1] += sample.get('sum', 0.0)
+    rows = [(key, count, seconds, seconds / count if count else 0.0)
+            for key, (count, seconds) in totals.items()]
+    rows.sort(key=lambda row: row[2] if args.sort == 'total' else row[3], reverse=True)
+    print(f'{"/".join(LABELS[:keep]):<70} {"回数":>8} {"合計(s)":>10} {"平均(ms)":>10}')
+    for key, count, seconds, mean in rows[:args.top]:
+        print(f'{"/".join(key):<70} {int(count):>8} {seconds:>10.3f} {mean * 1000:>10.2f}')
+    return 0
+
+
+def show_profiles(args, parser):
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files += sorted(glob.glob(os.path.join(path, '**', '*.prof'), recursive=True))
+        else:
+            files.append(path)
+    if args.match:
+        files = [path for path in files if args.match in os.path.basename(path)]
+    if not files:
+        parser.error('プロファイルが見つかりません')
+
+    stats = pstats.Stats(*files)
+    print(f'{len(files)} 件のプロファイルをまとめました')
+    if args.out:
+        stats.dump_stats(args.out)
+    # ファイルごとの見出しは省き、まとめた結果だけを表示する
+    stats.files = []
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='計測結果を時間のかかる順に表示する')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    metrics = commands.add_parser('metrics', help='コールバックの処理時間を遅い順に表示する')
+    metrics.add_argument('source', help='/metrics の URL または書き出したファイル')
+    metrics.add_argument('--by', choices=('callback', 'round', 'session'), default='callback',
+                         help='集計の単位（callback はラウンド・セッションをまとめる）')
+    metrics.add_argument('--sort', choices=('total', 'mean'), default='total', help='並べ替えの基準')
+    metrics.add_argument('--top', type=int, default=20, help='表示する行数')
+
+    profiles = commands.add_parser('profiles', help='保存したプロファイルをまとめて時間のかかる関数を表示する')
+    profiles.add_argument('paths', nargs='+', help='.prof ファイルまたはそれを含むディレクトリ')
+    profiles.add_argument('--match', help='ファイル名にこの文字列を含むプロファイルだけを使う')
+    profiles.add_argument('--sort', default='cumulative', help='並べ替えの基準（pstats の sort_stats）')
+    profiles.add_argument('--top', type=int, default=25, help='表示する関数の数')
+    profiles.add_argument('--out', help='まとめたプロファイルの保存先（snakeviz などで開ける）')
+
+    args = parser.parse_args(argv)
+    if args.command == 'metrics':
+        return show_metrics(args)
+    return show_profiles(args, profiles)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
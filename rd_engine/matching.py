@@ -0,0 +1,361 @@
+"""
+グループのマッチング
+
+セッション設定 matching でラウンドごとのグループ分けの方式を選ぶ。
+
+- "partner": 全ラウンドで同じグループ（既定）
+- "stranger": ラウンドごとにランダムに組み替える
+- "perfect_stranger": 一度同じグループになった相手とは二度と組まない
+
+group_by_arrival_time=True の場合は、待機ページに到着した順にグループを作る。
+"partner" では1ラウンド目に作ったグループを最後まで使い、それ以外の方式では
+毎ラウンド到着順に組み直す（"perfect_stranger" では過去の相手を除いて組む）。
+
+到着順でない場合の組み合わせは creating_session で全ラウンド分を事前に生成し、
+session.vars に保存して各ラウンドで参照する。1ラウンド目は oTree の既定と同じ
+参加者の順のグループ分けになる。
+
+"perfect_stranger" の組み合わせは分解可能デザインから構成する（perfect_stranger_rounds）。
+
+- 2人ずつ: 総当たり（円周法、参加者数 - 1 ラウンド）
+- グループ数 m の素因数がすべて1グループの人数以上、または m が1グループの人数以上の
+  素数べき: 平行移動のデザイン（m ラウンド、1グループの人数が m を割り切れば m + 1）
+- CYCLIC_DESIGNS にある人数: 基底のラウンドを巡回的に展開したデザイン
+
+構成したラウンドの順序と参加者への割り当ては乱数で選ぶ。どの構成でもラウンドが
+足りない人数では、ランダムな探索（perfect_stranger_search）で組み合わせを探す。
+"""
+import itertools
+
+PARTNER = 'partner'
+STRANGER = 'stranger'
+PERFECT_STRANGER = 'perfect_stranger'
+MODES = (PARTNER, STRANGER, PERFECT_STRANGER)
+
+# perfect_stranger の組み合わせを探すときの、全ラウンドのやり直し回数と
+# 1ラウンドあたりの探索の上限（構成できない人数のみ）
+MAX_ATTEMPTS = 50
+MAX_STEPS = 20000
+
+# 基底のラウンドを巡回的に展開する分解可能デザイン
+# (参加者数, 1グループの人数) → (法 q, 行の数, 基底のラウンドのリスト)
+# 点 j*q + x（行 j, x ∈ Z_q）は x に t (0 ≦ t < q) を加えて移し、行の数*q 以上の点は
+# 動かさない。基底のラウンド1つから q ラウンドができる。
+CYCLIC_DESIGNS = {
+    # 13ラウンド。Z_13 × 3行 + 固定点1つで、どの2人もちょうど1回同じグループになる
+    (40, 4): (13, 3, [[
+        [0, 15, 33, 39], [2, 4, 13, 21], [14, 24, 36, 38], [8, 9, 27, 30], [18, 19, 26, 34],
+        [5, 10, 17, 23], [3, 7, 31, 32], [1, 11, 28, 37], [16, 25, 29, 35], [6, 12, 20, 22],
+    ]]),
+}
+
+
+def matching_mode(session):
+    """セッション設定からマッチングの方式を求める"""
+    mode = session.config.get('matching', PARTNER)
+    if mode not in MODES:
+        raise ValueError(f'未知の matching です: {mode}（{", ".join(MODES)} のいずれか）')
+    return mode
+
+
+def by_arrival(session):
+    """到着順にグループを作るか"""
+    return session.config.get('group_by_arrival_time', False)
+
+
+# 説明ページに表示する対戦相手の決まり方
+DESCRIPTIONS = {
+    PARTNER: '対戦相手は全ラウンドを通じて変わりません。',
+    STRANGER: '対戦相手はラウンドごとにランダムに組み替えられます（同じ相手と再び組むこともあります）。',
+    PERFECT_STRANGER: '対戦相手はラウンドごとに組み替えられ、一度同じグループになった相手と再び組むことはありません。',
+}
+ARRIVAL_DESCRIPTIONS = {
+    PARTNER: '対戦相手は待機ページに到着した順に決まり、その後は全ラウンドを通じて変わりません。',
+    STRANGER: '対戦相手はラウンドごとに、待機ページに到着した順に組み替えられます（同じ相手と再び組むこともあります）。',
+    PERFECT_STRANGER: '対戦相手はラウンドごとに、待機ページに到着した順に組み替えられます。'
+                      '一度同じグループになった相手と再び組むことはありません。',
+}
+
+
+def describe(session):
+    """マッチングの方式の説明文"""
+    descriptions = ARRIVAL_DESCRIPTIONS if by_arrival(session) else DESCRIPTIONS
+    return descriptions[matching_mode(session)]
+
+
+def regroups_on_arrival(session, round_number):
+    """このラウンドで到着順の待機ページを表示するか"""
+    if not by_arrival(session):
+        return False
+    return round_number == 1 or matching_mode(session) != PARTNER
+
+
+def build_schedule(num_players, group_size, num_rounds, mode, generator):
+    """全ラウンド分のグループ分け（id_in_subsession の行列）を生成"""
+    if num_players % group_size != 0:
+        raise ValueError(f'参加者数 {num_players} は {group_size} 人ずつのグループに分けられません')
+    players = list(range(1, num_players + 1))
+    first = [players[i:i + group_size] for i in range(0, num_players, group_size)]
+    if mode == PARTNER:
+        return [first] * num_rounds
+    if mode == STRANGER:
+        schedule = [first]
+        for _ in range(num_rounds - 1):
+            shuffled = generator.sample(players, num_players)
+            schedule.append([shuffled[i:i + group_size] for i in range(0, num_players, group_size)])
+        return schedule
+
+    # perfect_stranger
+    rounds = perfect_stranger_rounds(num_players, group_size)
+    if len(rounds) >= num_rounds:
+        return assign_players(rounds, first, num_rounds, generator)
+    schedule = perfect_stranger_search(players, first, group_size, num_rounds, generator)
+    if schedule is None:
+        raise ValueError(
+            f'{num_players} 人・{group_size} 人ずつのグループで {num_rounds} ラウンド分の '
+            'perfect_stranger の組み合わせを作れません（ラウンド数を減らしてください）'
+        )
+    return schedule
+
+
+def perfect_stranger_rounds(num_players, group_size):
+    """どの2人も二度は同じグループにならないラウンドの列を構成する（点は 0 始まり）
+
+    使える構成のうち、ラウンド数が最も多いものを返す（ない場合は空のリスト）。
+    """
+    num_groups = num_players // group_size
+    candidates = []
+    if group_size == 2:
+        candidates.append(round_robin(num_players))
+    if smallest_prime_factor(num_groups) >= group_size:
+        m = num_groups
+        candidates.append(translate_design(m, group_size, lambda a, b: (a + b) % m, lambda a, b: a * b % m))
+    elif num_groups >= group_size and prime_power(num_groups):
+        add, mul = finite_field(num_groups)
+        candidates.append(translate_design(num_groups, group_size, add, mul))
+    if (num_players, group_size) in CYCLIC_DESIGNS:
+        candidates.append(cyclic_design(*CYCLIC_DESIGNS[num_players, group_size]))
+    return max(candidates, key=len, default=[])
+
+
+def round_robin(num_players):
+    """2人ずつの総当たり（円周法）: 最後の点を固定し、残りを1つずつ回す"""
+    m = num_players - 1
+    rounds = []
+    for r in range(m):
+        matrix = [[r, m]]
+        for i in range(1, num_players // 2):
+            matrix.append([(r + i) % m, (r - i) % m])
+        rounds.append(matrix)
+    return rounds
+
+
+def smallest_prime_factor(number):
+    """最小の素因数（1 には素因数がないので無限大）"""
+    for p in range(2, int(number ** 0.5) + 1):
+        if number % p == 0:
+            return p
+    return number if number > 1 else float('inf')
+
+
+def prime_power(number):
+    """number が素数べき p^a なら (p, a)、そうでなければ None"""
+    p = smallest_prime_factor(number)
+    a = 0
+    while number % p == 0:
+        number //= p
+        a += 1
+    return (p, a) if number == 1 else None
+
+
+def finite_field(q):
+    """有限体 GF(q) の加法と乗法（元は 0..q-1 で、p 進の各桁を多項式の係数とする）"""
+    p, a = prime_power(q)
+
+    def digits(x):
+        return [x // p ** i % p for i in range(a)]
+
+    def number(coefficients):
+        return sum(c * p ** i for i, c in enumerate(coefficients))
+
+    def add(x, y):
+        return number([(c + d) % p for c, d in zip(digits(x), digits(y))])
+
+    def multiply(x, y, modulus):
+        # modulus は x^a の係数を除いた既約多項式の係数（x^a = -modulus）
+        product = [0] * (2 * a - 1)
+        for i, c in enumerate(digits(x)):
+            for j, d in enumerate(digits(y)):
+                product[i + j] = (product[i + j] + c * d) % p
+        for i in range(2 * a - 2, a - 1, -1):
+            c = product[i]
+            for j, d in enumerate(modulus):
+                product[i - a + j] = (product[i - a + j] - c * d) % p
+        return number(product[:a])
+
+    # 零因子のない乗法になる最初の多項式（既約多項式）を使う
+    for modulus in range(q):
+        table = [[multiply(x, y, digits(modulus)) for y in range(q)] for x in range(q)]
+        if all(table[x][y] for x in range(1, q) for y in range(1, q)):
+            return add, lambda x, y: table[x][y]
+    raise ValueError(f'GF({q}) の既約多項式が見つかりません')
+
+
+def translate_design(m, group_size, add, mul):
+    """点 i*m + c（行 i, c は m 元の環の元）のラウンド r のグループ g は {i*m + (g + i*r)}
+
+    別の行の2点が同じグループになるのは (i - i')r = c - c' となる r だけで、
+    i - i' で割り算できる環（体、または素因数がすべて group_size 以上の Z_m）なら
+    r はちょうど1つに決まる。同じ行の2点は同じグループにならないので、
+    group_size が m を割り切れば各行を分けたラウンドを1つ加えられる。
+    """
+    rounds = [
+        [[i * m + add(g, mul(i, r)) for i in range(group_size)] for g in range(m)]
+        for r in range(m)
+    ]
+    if m % group_size == 0:
+        points = list(range(group_size * m))
+        rounds.append([points[i:i + group_size] for i in range(0, len(points), group_size)])
+    return rounds
+
+
+def cyclic_design(q, rows, bases):
+    """CYCLIC_DESIGNS の基底のラウンドを展開する"""
+    def shift(point, t):
+        return point if point >= rows * q else point - point % q + (point % q + t) % q
+
+    return [
+        [[shift(point, t) for point in group] for group in base]
+        for base in bases
+        for t in range(q)
+    ]
+
+
+def assign_players(rounds, first, num_rounds, generator):
+    """構成したラウンドの点を参加者に割り当てる
+
+    使うラウンドとその順序、点と参加者の対応は乱数で選び、
+    1ラウンド目は first（既定のグループ分け）になるように対応させる。
+    """
+    rounds = generator.sample(rounds, num_rounds)
+    player_of = {}
+    for points, group in zip(generator.sample(rounds[0], len(rounds[0])), first):
+        for point, player in zip(generator.sample(points, len(points)), group):
+            player_of[point] = player
+    return [first] + [
+        [[player_of[point] for point in points] for points in matrix]
+        for matrix in rounds[1:]
+    ]
+
+
+def perfect_stranger_search(players, first, group_size, num_rounds, generator):
+    """構成できない人数でランダムに組み合わせを探す（見つからなければ None）
+
+    途中のラウンドで行き詰まったら最初からやり直す。
+    """
+    num_players = len(players)
+    for _ in range(MAX_ATTEMPTS):
+        schedule = [first]
+        met = {p: set() for p in players}
+        record_partners(met, first)
+        for _ in range(num_rounds - 1):
+            matrix = perfect_stranger_round(generator.sample(players, num_players), group_size, met)
+            if matrix is None:
+                break
+            record_partners(met, matrix)
+            schedule.append(matrix)
+        else:
+            return schedule
+    return None
+
+
+def perfect_stranger_round(order, group_size, met):
+    """過去に同じグループになった相手を含まない組み合わせをバックトラックで探す
+
+    order の順に、まだグループのない先頭の参加者と組める相手を試す。
+    見つからなければ None を返す。
+    """
+    steps = 0
+
+    def search(remaining):
+        nonlocal steps
+        if not remaining:
+            return []
+        head, rest = remaining[0], remaining[1:]
+        candidates = [p for p in rest if p not in met[head]]
+        for others in itertools.combinations(candidates, group_size - 1):
+            steps += 1
+            if steps > MAX_STEPS:
+                return None
+            if any(q in met[p] for p, q in itertools.combinations(others, 2)):
+                continue
+            matrix = search([p for p in rest if p not in others])
+            if matrix is not None:
+                return [[head, *others]] + matrix
+        return None
+
+    return search(order)
+
+
+def pick_strangers(candidates, group_size, met):
+    """candidates の先頭から、互いに初対面の group_size 人を選ぶ（いなければ None）"""
+    group = []
+    for p in candidates:
+        if all(p not in met[q] for q in group):
+            group.append(p)
+            if len(group) == group_size:
+                return group
+    return None
+
+
+def record_partners(met, matrix):
+    """同じグループになった相手を記録"""
+    for group in matrix:
+        for p, q in itertools.permutations(group, 2):
+            met[p].add(q)
+
+
+def apply_schedule(subsession, schedule):
+    """事前生成したこのラウンドのグループ分けを適用"""
+    subsession.set_group_matrix(schedule[subsession.round_number - 1])
+
+
+def arrival_group(subsession, waiting_players, group_size):
+    """到着済みのプレイヤーからグループを1つ作る（group_by_arrival_time_method 用）
+
+    到着順に選び、perfect_stranger では過去に同じグループになった相手を避ける。
+    """
+    if matching_mode(subsession.session) == PERFECT_STRANGER:
+        # 過去の相手は参加者変数に id_in_session で記録している
+        partners = {p: set(p.participant.vars.get('partners', [])) for p in waiting_players}
+        met = {
+            p: {q for q in waiting_players if q.participant.id_in_session in partners[p]}
+            for p in waiting_players
+        }
+        group = pick_strangers(waiting_players, group_size, met)
+    elif len(waiting_players) >= group_size:
+        group = waiting_players[:group_size]
+    else:
+        group = None
+    if group:
+        for p in group:
+            p.participant.vars['partners'] = sorted(
+                set(p.participant.vars.get('partners', []))
+                | {q.participant.id_in_session for q in group if q is not p}
+            )
+    return group
+
+
+def draw_index(subsession, group):
+    """事前生成した乱数系列の中でこのグループが使う位置（1始まり）
+
+    到着順のグループは id_in_subsession が連番にならないため、
+    ラウンド内で結果を計算した順に番号を振る。
+    """
+    if not by_arrival(subsession.session):
+        return group.id_in_subsession
+    counters = dict(subsession.session.vars.get('draw_counters', {}))
+    key = str(subsession.round_number)
+    counters[key] = counters.get(key, 0) + 1
+    subsession.session.vars['draw_counters'] = counters
+    return counters[key]
@@ -0,0 +1,258 @@
+"""
+oTree のデータエクスポートからセッションを再計算して監査する
+
+アプリごとの CSV エクスポート（管理画面の Data → 各アプリ）を読み込み、
+記録された意思決定（cards_invested / effort, cost）と subsession.random_seed
+から、グループの合計枚数・サイコロの目・当選者・各プレイヤーの利益と累積値を
+再計算し、記録された値との差分を報告する。
+
+R&Dゲームは Engine と事前生成の乱数系列（rd_engine.rng）を、
+two_stage_contest はアプリの resolve_groups をそのまま使うので、
+本番と同じ規則で再計算される。
+
+使い方:
+    python -m rd_engine.replay r_and_d_game_spillover_700_2026-10-17.csv
+    python -m rd_engine.replay export.csv --app two_stage_contest
+"""
+import argparse
+import csv
+import math
+import os
+import sys
+from collections import defaultdict
+
+import rd_engine
+from rd_engine import rng
+from rd_engine.simulate import PRESETS
+
+CONTEST_APP = 'two_stage_contest'
+APPS = sorted(PRESETS) + [CONTEST_APP]
+
+# 再計算に必要な列（アプリごとの CSV エクスポートの列名）
+KEY_COLUMNS = (
+    'participant.code', 'session.code', 'subsession.round_number',
+    'group.id_in_subsession', 'player.id_in_group',
+)
+RD_COLUMNS = KEY_COLUMNS + ('player.cards_invested',)
+CONTEST_COLUMNS = KEY_COLUMNS + ('player.effort', 'player.cost')
+
+
+def detect_app(path):
+    """ファイル名からアプリ名を推定（長い名前から照合）"""
+    name = os.path.basename(path)
+    for app in sorted(APPS, key=len, reverse=True):
+        if name.startswith(app):
+            return app
+    return None
+
+
+def parse_value(text):
+    """CSV の文字列を数値に変換（空欄は None）"""
+    if text == '':
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        number = float(text)
+    except ValueError:
+        return text
+    return int(number) if number.is_integer() else number
+
+
+def load_export(path):
+    """アプリごとの CSV エクスポートを行の辞書のリストとして読み込む"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return [
+            {
+                # コードやラベルは数字だけでも文字列のまま扱う
+                key: value if key.endswith(('.code', '.label')) else parse_value(value)
+                for key, value in row.items()
+            }
+            for row in csv.DictReader(f)
+        ]
+
+
+def check_layout(rows, columns):
+    """アプリごとの CSV エクスポートの列があるか確かめる
+
+    カスタムエクスポート（*_custom.csv）など列名の違うファイルは、
+    何も比べずに「差分 0 件」とならないようにエラーにする。
+    """
+    if not rows:
+        raise ValueError('データの行がありません')
+    missing = [column for column in columns if column not in rows[0]]
+    if missing:
+        raise ValueError(
+            f'アプリごとの CSV エクスポートの形式ではありません（{", ".join(missing)} の列がありません）。'
+            'カスタムエクスポートは再計算に使えません'
+        )
+
+
+def same_value(recorded, value):
+    """記録値と再計算値が等しいか（小数は丸め誤差を許す）"""
+    if recorded is None or value is None:
+        return recorded == value
+    if isinstance(recorded, float) or isinstance(value, float):
+        return math.isclose(recorded, value, rel_tol=1e-9, abs_tol=1e-9)
+    return recorded == value
+
+
+def compare(row, expected, diffs):
+    """行の各列を再計算値と比べ、差分を diffs に加える。比べた列の数を返す"""
+    compared = 0
+    for column, value in expected.items():
+        if column not in row:
+            continue
+        compared += 1
+        if not same_value(row[column], value):
+            diffs.append((row, column, row[column], value))
+    return compared
+
+
+def group_rows(rows):
+    """(セッション, ラウンド) → グループ番号 → id_in_group 順の行 にまとめる"""
+    sessions = defaultdict(lambda: defaultdict(list))
+    for row in rows:
+        if row.get('player.id_in_group') is None:
+            # まだこのアプリに到達していない参加者の行
+            continue
+        key = (row['session.code'], row['subsession.round_number'])
+        sessions[key][row['group.id_in_subsession']].append(row)
+    for groups in sessions.values():
+        for members in groups.values():
+            members.sort(key=lambda row: row['player.id_in_group'])
+    return sessions
+
+
+def session_seed(row):
+    """エクスポートの行からシードを求める"""
+    seed = row.get('subsession.random_seed')
+    if seed is None:
+        return rng.seed_from_code(row['session.code'])
+    return int(seed)
+
+
+def replay_rd(app, rows, treatment=None):
+    """R&Dゲームの全グループを再計算し (行, 列, 記録値, 再計算値) の差分を返す"""
+    spillover_reward, default_treatment = PRESETS[app]
+    engine = rd_engine.Engine(spillover_reward=spillover_reward)
+    if treatment is None:
+        treatment = default_treatment
+
+    check_layout(rows, RD_COLUMNS)
+    sessions = group_rows(rows)
+    streams = {}
+    totals = defaultdict(lambda: [0, 0])  # 参加者 → [累積投資額, 累積利益]
+    diffs = []
+    compared = 0
+    for (code, round_number), groups in sorted(sessions.items()):
+        if code not in streams:
+            first = next(iter(groups.values()))[0]
+            num_groups = len(groups)
+            streams[code] = rng.generate_streams(
+                session_seed(first), rd_engine.NUM_ROUNDS, num_groups
+            )
+        group_ids = sorted(groups)
+        investments = [[row['player.cards_invested'] for row in groups[g]] for g in group_ids]
+        # 到着順のグループ分けでは乱数系列の位置が group.draw_index に記録されている
+        draws = [
+            rng.stream_draw(streams[code], round_number, groups[g][0].get('group.draw_index') or g)
+            for g in group_ids
+        ]
+        results = engine.resolve(investments, treatment, draws)
+
+        for g, result in zip(group_ids, results):
+            members = groups[g]
+            expected_group = {
+                'group.total_cards_invested': result['total_cards_invested'],
+                'group.success_probability': result['success_probability'],
+                'group.is_rd_successful': int(result['is_rd_successful']),
+                'group.dice_roll': result['dice_roll'],
+                'group.successful_player': result['successful_player'],
+            }
+            for row, payoff in zip(members, result['payoffs']):
+                # グループの列はメンバー全員の行に出力されるので、全員の行で比べる
+                compared += compare(row, expected_group, diffs)
+                running = totals[row['participant.code']]
+                running[0] += row['player.cards_invested'] * engine.card_value
+                running[1] += int(payoff)
+                expected = {
+                    'player.payoff': payoff,
+                    'player.total_investment': running[0],
+                    'player.cumulative_payoff': running[1],
+                }
+                compared += compare(row, expected, diffs)
+    if not compared:
+        raise ValueError('再計算した値と比べられる列がありません')
+    return diffs
+
+
+def replay_contest(rows):
+    """two_stage_contest の全グループを再計算し差分を返す"""
+    import two_stage_contest
+
+    check_layout(rows, CONTEST_COLUMNS)
+    sessions = group_rows(rows)
+    totals = defaultdict(float)
+    diffs = []
+    compared = 0
+    for (code, round_number), groups in sorted(sessions.items()):
+        group_ids = sorted(groups)
+        results = two_stage_contest.resolve_groups(
+            [[(row['player.effort'], row['player.cost']) for row in groups[g]] for g in group_ids],
+            round_number,
+        )
+        for g, group_results in zip(group_ids, results):
+            for row, (reward, rank, tied) in zip(groups[g], group_results):
+                payoff = reward - row['player.cost'] * row['player.effort']
+                totals[row['participant.code']] += payoff
+                expected = {
+                    'player.reward': reward,
+                    'player.rank': rank,
+                    'player.tied': int(tied),
+                    'player.payoff': payoff,
+                    'player.total_payoff': totals[row['participant.code']],
+                }
+                compared += compare(row, expected, diffs)
+    if not compared:
+        raise ValueError('再計算した値と比べられる列がありません')
+    return diffs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='データエクスポートからセッションを再計算して差分を報告する')
+    parser.add_argument('paths', nargs='+', help='アプリごとの CSV エクスポート')
+    parser.add_argument('--app', choices=APPS, help='アプリ名（省略時はファイル名から推定）')
+    parser.add_argument('--treatment', choices=sorted(rd_engine.TREATMENT_NAMES),
+                        help='R&Dゲームの処遇条件（省略時はアプリの既定）')
+    parser.add_argument('--limit', type=int, default=20, help='表示する差分の最大件数')
+    args = parser.parse_args(argv)
+    treatment = rd_engine.TREATMENT_NAMES.get(args.treatment)
+
+    num_diffs = 0
+    for path in args.paths:
+        app = args.app or detect_app(path)
+        if app is None:
+            parser.error(f'アプリ名を推定できません: {path}（--app で指定してください）')
+        rows = load_export(path)
+        try:
+            if app == CONTEST_APP:
+                diffs = replay_contest(rows)
+            else:
+                diffs = replay_rd(app, rows, treatment)
+        except ValueError as e:
+            parser.error(f'{path}: {e}')
+
+        print(f'{path}: {app}, {len(rows)} 行, 差分 {len(diffs)} 件')
+        for row, column, recorded, replayed in diffs[:args.limit]:
+            print(f'  session={row["session.code"]} round={row["subsession.round_number"]} '
+                  f'group={row["group.id_in_subsession"]} player={row["player.id_in_group"]} '
+                  f'{column}: 記録={recorded} 再計算={replayed}')
+        num_diffs += len(diffs)
+    return 1 if num_diffs else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
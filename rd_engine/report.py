@@ -0,0 +1,141 @@
+"""
+管理画面のレポート用の集計
+
+set_payoffs でグループの結果を計算するたびに、そのラウンドのサブセッションの
+フィールド report_<名前> に合計を加算しておく。vars_for_admin_report は全ラウンドの
+サブセッションの集計を読むだけなので、参加者数に関係なく一定の時間で表示できる
+（プレイヤーの表は読まない）。グループごとの更新はサブセッションの1行だけで、
+session.vars（乱数系列やグループ分けの表を含む）を書き直さない。
+
+ラウンドごとの合計（各アプリの Subsession のフィールド）:
+- R&D: groups, players, cards（投資枚数の合計）, successes（成功したグループ数）, payoff
+- contest: groups, players, effort（エフォートの合計）, wins, ties, losses, payoff
+
+累積利益の分布は各参加者の最新の累積利益だけを数える。
+ラウンドが進むと、前の累積利益の階級から1人減らして新しい階級に1人加える。
+この増減をラウンドごとに report_bins（JSON）に持ち、表示時に全ラウンド分を足す。
+"""
+import json
+import math
+
+RD_COUNTS = ('groups', 'players', 'cards', 'successes', 'payoff')
+CONTEST_COUNTS = ('groups', 'players', 'effort', 'wins', 'ties', 'losses', 'payoff')
+
+
+def bin_of(value, width):
+    """value が入る階級の下限"""
+    return int(math.floor(value / width) * width)
+
+
+def add_bins(bins, changes):
+    """階級ごとの人数 bins に増減 changes を足す（0 になった階級は消す）"""
+    for low, count in changes.items():
+        bins[low] = bins.get(low, 0) + count
+        if not bins[low]:
+            del bins[low]
+
+
+def load_bins(text):
+    """report_bins の JSON を {階級の下限: 人数} に（JSON のキーは文字列になる）"""
+    return {int(low): count for low, count in json.loads(text or '{}').items()}
+
+
+def record_group(subsession, counts, payoff_moves, bin_width):
+    """解決したグループの集計をサブセッションのフィールドに加える
+
+    payoff_moves は各プレイヤーの (前ラウンドまでの累積利益, 今回までの累積利益)。
+    1ラウンド目の前の値は None。
+    """
+    for name, value in counts.items():
+        field = f'report_{name}'
+        setattr(subsession, field, (subsession.field_maybe_none(field) or 0) + value)
+    # このラウンドの分布の増減（前の階級から1人減らし、新しい階級に1人加える）
+    bins = load_bins(subsession.field_maybe_none('report_bins'))
+    for previous, current in payoff_moves:
+        if previous is not None:
+            add_bins(bins, {bin_of(previous, bin_width): -1})
+        add_bins(bins, {bin_of(current, bin_width): 1})
+    subsession.report_bins = json.dumps(bins)
+
+
+def aggregate_for(subsessions, names, bin_width):
+    """全ラウンドのサブセッションの集計を {'rounds': {ラウンド: 合計}, 'bins': 分布} にまとめる"""
+    aggregate = {'rounds': {}, 'bins': {}, 'bin_width': bin_width}
+    for subsession in subsessions:
+        if not subsession.field_maybe_none('report_groups'):
+            continue
+        aggregate['rounds'][subsession.round_number] = {
+            name: subsession.field_maybe_none(f'report_{name}') or 0 for name in names
+        }
+        add_bins(aggregate['bins'], load_bins(subsession.report_bins))
+    return aggregate
+
+
+def share(part, whole):
+    """割合（%、小数第1位まで）。分母が 0 なら None"""
+    return round(100 * part / whole, 1) if whole else None
+
+
+def mean(total, count):
+    return round(total / count, 2) if count else None
+
+
+def distribution(aggregate):
+    """累積利益の分布を表示用の [(下限, 上限, 人数)] に"""
+    width = aggregate['bin_width']
+    return [(low, low + width, count) for low, count in sorted(aggregate['bins'].items())]
+
+
+def rd_vars(subsessions, round_number, bin_width):
+    """R&Dゲームの vars_for_admin_report（subsessions は全ラウンドのサブセッション）"""
+    aggregate = aggregate_for(subsessions, RD_COUNTS, bin_width)
+    rounds = []
+    for number, totals in sorted(aggregate['rounds'].items()):
+        rounds.append(dict(
+            round_number=number,
+            groups=totals['groups'],
+            mean_cards=mean(totals['cards'], totals['players']),
+            success_rate=share(totals['successes'], totals['groups']),
+            mean_payoff=mean(totals['payoff'], totals['players']),
+        ))
+    current = aggregate['rounds'].get(round_number, {})
+    all_rounds = {
+        name: sum(totals[name] for totals in aggregate['rounds'].values())
+        for name in ('groups', 'players', 'cards', 'successes')
+    }
+    return dict(
+        resolved_groups=current.get('groups', 0),
+        mean_cards=mean(current.get('cards', 0), current.get('players', 0)),
+        success_rate=share(current.get('successes', 0), current.get('groups', 0)),
+        overall_mean_cards=mean(all_rounds['cards'], all_rounds['players']),
+        overall_success_rate=share(all_rounds['successes'], all_rounds['groups']),
+        rounds=rounds,
+        payoff_distribution=distribution(aggregate),
+    )
+
+
+def contest_vars(subsessions, round_number, bin_width):
+    """two_stage_contest の vars_for_admin_report（subsessions は全ラウンドのサブセッション）"""
+    aggregate = aggregate_for(subsessions, CONTEST_COUNTS, bin_width)
+    rounds = []
+    for number, totals in sorted(aggregate['rounds'].items()):
+        rounds.append(dict(
+            round_number=number,
+            groups=totals['groups'],
+            mean_effort=mean(totals['effort'], totals['players']),
+            wins=totals['wins'],
+            ties=totals['ties'],
+            losses=totals['losses'],
+            mean_payoff=mean(totals['payoff'], totals['players']),
+        ))
+    current = aggregate['rounds'].get(round_number, {})
+    players = current.get('players', 0)
+    return dict(
+        resolved_groups=current.get('groups', 0),
+        mean_effort=mean(current.get('effort', 0), players),
+        win_share=share(current.get('wins', 0), players),
+        tie_share=share(current.get('ties', 0), players),
+        loss_share=share(current.get('losses', 0), players),
+        rounds=rounds,
+        payoff_distribution=distribution(aggregate),
+    )
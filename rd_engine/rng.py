@@ -0,0 +1,73 @@
+"""
+セッションごとのシード付き乱数
+
+セッションのシードは設定 random_seed、なければセッションコードから導出する。
+R&Dゲームのサイコロの目と当選者抽選用の一様乱数は creating_session で
+全ラウンド・全グループ分を事前に生成して session.vars に保存し、
+結果の計算時には (ラウンド, グループ) の添字で参照するだけにする。
+同じシードからは常に同じ系列が得られるので、セッションを再現・監査できる。
+"""
+import array
+import bisect
+import hashlib
+import itertools
+import random
+
+from rd_engine import DICE_FACES
+
+
+def session_seed(session):
+    """セッションのシードを求める"""
+    seed = session.config.get('random_seed')
+    if seed is None:
+        seed = seed_from_code(session.code)
+    return int(seed)
+
+
+def seed_from_code(code):
+    """セッションコードから決定的にシードを導出"""
+    return int(hashlib.sha256(code.encode()).hexdigest()[:15], 16)
+
+
+def seeded_random(seed, label):
+    """用途ごとに独立した乱数生成器を作る"""
+    return random.Random(f'{seed}:{label}')
+
+
+def generate_streams(seed, num_rounds, num_groups):
+    """全ラウンド・全グループ分のサイコロの目と抽選用の一様乱数を生成"""
+    rng = seeded_random(seed, 'rd')
+    size = num_rounds * num_groups
+    return dict(
+        num_groups=num_groups,
+        dice=bytes(rng.randint(1, DICE_FACES) for _ in range(size)),
+        draws=array.array('d', (rng.random() for _ in range(size))),
+    )
+
+
+def stream_draw(streams, round_number, group_index):
+    """(ラウンド, グループ) の (サイコロの目, 一様乱数) を参照
+
+    事前生成された系列がない・範囲外の場合は None を返す。
+    """
+    if not streams or group_index > streams['num_groups']:
+        return None
+    i = (round_number - 1) * streams['num_groups'] + group_index - 1
+    if i >= len(streams['dice']):
+        return None
+    return streams['dice'][i], streams['draws'][i]
+
+
+def fresh_draw():
+    """系列がない場合にその場で引く (サイコロの目, 一様乱数)"""
+    return random.randint(1, DICE_FACES), random.random()
+
+
+def pick_weighted(weights, u):
+    """一様乱数 u で重みに比例した添字を選ぶ（random.choices と同じ方式）"""
+    total = sum(weights)
+    if total <= 0:
+        # 重みがない場合は一様に選ぶ
+        return min(int(u * len(weights)), len(weights) - 1)
+    cumulative = list(itertools.accumulate(weights))
+    return min(bisect.bisect_right(cumulative, u * total), len(weights) - 1)
@@ -0,0 +1,153 @@
+"""
+R&D投資ゲームの戦略プロファイル・シミュレータ
+
+Group.set_payoffs と同じ Engine のテーブルを使い、全ての純粋戦略プロファイル
+（4人・0〜5枚なら 6^4 = 1296 通り）について期待利益と分散を求め、
+最適反応表と純粋戦略ナッシュ均衡を出力する。
+
+サイコロと当選者の抽選は離散分布なので、乱数で試行を重ねる代わりに
+分布を直接足し合わせて厳密な期待値・分散を計算する。各ラウンドは独立なので、
+同じプロファイルを繰り返す場合の Nラウンド合計は期待値・分散ともに N 倍になる。
+
+使い方:
+    python -m rd_engine.simulate
+    python -m rd_engine.simulate --preset r_and_d_game_spillover_700 --rounds 10
+    python -m rd_engine.simulate --success-reward 1800 --spillover-reward 900
+"""
+import argparse
+import itertools
+
+import rd_engine
+
+
+# アプリごとの報酬設定と処遇条件
+PRESETS = {
+    'r_and_d_game_spillover_700': (700, rd_engine.SPILL_OVER),
+    'r_and_d_game_spillover_1300': (1300, rd_engine.SPILL_OVER),
+    'r_and_d_game_winner_takes_all': (1300, rd_engine.WINNER_TAKES_ALL),
+}
+
+
+def outcome_distribution(engine, profile):
+    """プロファイルに対する (結果, 確率) を各プレイヤーについて返す"""
+    total = sum(profile)
+    p_success = engine.success_faces[total] / rd_engine.DICE_FACES
+    distributions = []
+    for cards in profile:
+        if total > 0:
+            p_win = cards / total
+        else:
+            # 誰も投資していない場合は一様に当選者を選ぶ
+            p_win = 1 / len(profile)
+        distributions.append((
+            (rd_engine.FAILURE, 1 - p_success),
+            (rd_engine.WINNER, p_success * p_win),
+            (rd_engine.LOSER, p_success * (1 - p_win)),
+        ))
+    return distributions
+
+
+def profile_moments(engine, profile, treatment):
+    """1ラウンドあたりの各プレイヤーの (期待利益, 分散) を返す"""
+    moments = []
+    for cards, distribution in zip(profile, outcome_distribution(engine, profile)):
+        mean = 0.0
+        second = 0.0
+        for outcome, probability in distribution:
+            value = engine.payoff(cards, outcome, treatment)
+            mean += probability * value
+            second += probability * value * value
+        moments.append((mean, max(second - mean * mean, 0.0)))
+    return moments
+
+
+def all_profiles(engine):
+    """全ての純粋戦略プロファイルを列挙"""
+    return itertools.product(range(engine.cards_per_player + 1), repeat=engine.players_per_group)
+
+
+def best_response_table(engine, treatment):
+    """他プレイヤーの合計投資枚数ごとの最適反応を返す
+
+    利益は自分の投資枚数と他プレイヤーの合計枚数だけで決まるため、
+    他プレイヤーの内訳は代表的な1通りで評価すればよい。
+    """
+    others = engine.players_per_group - 1
+    table = []
+    for others_total in range(others * engine.cards_per_player + 1):
+        # 他プレイヤーの合計枚数を満たす代表的な内訳（前から詰める）
+        rest = []
+        remaining = others_total
+        for _ in range(others):
+            rest.append(min(remaining, engine.cards_per_player))
+            remaining -= rest[-1]
+        values = [
+            profile_moments(engine, [cards] + rest, treatment)[0]
+            for cards in range(engine.cards_per_player + 1)
+        ]
+        best_mean = max(mean for mean, _ in values)
+        best = [cards for cards, (mean, _) in enumerate(values) if mean >= best_mean - 1e-9]
+        table.append(dict(others_total=others_total, best=best, values=values))
+    return table
+
+
+def pure_equilibria(engine, treatment, table=None):
+    """純粋戦略ナッシュ均衡を並べ替えの違いを除いて返す"""
+    if table is None:
+        table = best_response_table(engine, treatment)
+    equilibria = set()
+    for profile in all_profiles(engine):
+        total = sum(profile)
+        if all(cards in table[total - cards]['best'] for cards in profile):
+            equilibria.add(tuple(sorted(profile, reverse=True)))
+    return [
+        (profile, profile_moments(engine, profile, treatment))
+        for profile in sorted(equilibria, reverse=True)
+    ]
+
+
+def print_report(name, engine, treatment, rounds):
+    """最適反応表と均衡表を出力"""
+    table = best_response_table(engine, treatment)
+    label = '勝者総取り' if treatment == rd_engine.WINNER_TAKES_ALL else 'SpillOver'
+    print(f'=== {name}（{label}, 成功報酬={engine.success_reward}, '
+          f'失敗時報酬={engine.spillover_reward}, {rounds}ラウンド）')
+
+    print('\n最適反応表（他プレイヤーの合計枚数 → 最適な投資枚数, 1ラウンドの期待利益 / 標準偏差）')
+    for row in table:
+        mean, var = row['values'][row['best'][0]]
+        best = ','.join(str(cards) for cards in row['best'])
+        print(f'  {row["others_total"]:>3} → {best:<6} {mean:>9.1f} / {var ** 0.5:>8.1f}')
+
+    print(f'\n純粋戦略ナッシュ均衡（期待利益 / 標準偏差, {rounds}ラウンド合計）')
+    for profile, moments in pure_equilibria(engine, treatment, table):
+        cells = '  '.join(
+            f'{cards}枚: {mean * rounds:>8.1f} / {(var * rounds) ** 0.5:>7.1f}'
+            for cards, (mean, var) in zip(profile, moments)
+        )
+        print(f'  {profile}  {cells}')
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='R&D投資ゲームの戦略プロファイルを評価する')
+    parser.add_argument('--preset', choices=sorted(PRESETS), action='append',
+                        help='評価するアプリの設定（省略時は全て）')
+    parser.add_argument('--rounds', type=int, default=rd_engine.NUM_ROUNDS)
+    parser.add_argument('--success-reward', type=int)
+    parser.add_argument('--spillover-reward', type=int)
+    parser.add_argument('--card-value', type=int)
+    args = parser.parse_args(argv)
+
+    for name in args.preset or sorted(PRESETS):
+        spillover_reward, treatment = PRESETS[name]
+        engine = rd_engine.Engine(
+            spillover_reward=args.spillover_reward or spillover_reward,
+            success_reward=args.success_reward or rd_engine.SUCCESS_REWARD,
+            card_value=args.card_value or rd_engine.CARD_VALUE,
+        )
+        print_report(name, engine, treatment, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+R&D投資ゲームのパラメータ・スイープ
+
+success_reward / spillover_reward / card_value / players_per_group と
+成功確率の閾値スケジュールの格子を、プロセスプールで並列に評価する。
+各格子点は simulate と同じ Engine による厳密な期待値計算で、
+純粋戦略ナッシュ均衡とその期待利益・成功確率を求める。
+
+結果は1格子点1行の JSON Lines として逐次追記するので、中断しても
+同じコマンドを再実行すれば未評価の格子点だけが続きから計算される。
+
+使い方:
+    python -m rd_engine.sweep sweep.jsonl \\
+        --success-reward 1200,1500,1800 --spillover-reward 500,700,1300 \\
+        --players-per-group 3,4 --thresholds "0-4:0,5-11:1/3,12-16:1/2,17-:2/3"
+"""
+import argparse
+import concurrent.futures
+import fractions
+import itertools
+import json
+import os
+
+import rd_engine
+from rd_engine.simulate import pure_equilibria
+
+
+# 上限を省略した閾値（"17-:2/3" など）の上限
+OPEN_MAX = 10 ** 9
+
+
+def parse_int_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def parse_thresholds(text):
+    """'0-4:0,5-11:1/3,17-:2/3' 形式の閾値スケジュールを辞書に変換"""
+    thresholds = {}
+    for item in text.split(','):
+        cards, probability = item.split(':')
+        min_cards, max_cards = cards.split('-')
+        max_cards = int(max_cards) if max_cards else OPEN_MAX
+        thresholds[(int(min_cards), max_cards)] = float(fractions.Fraction(probability))
+    return thresholds
+
+
+def default_thresholds():
+    """既定の閾値スケジュール（最上位の区間は上限なし）
+
+    rd_engine.SUCCESS_THRESHOLDS の最上位の区間は4人・5枚の上限（20枚）で
+    閉じているので、そのまま使うと players_per_group を増やしたときに
+    上限を超える合計枚数の成功確率が 0 になってしまう。
+    """
+    bands = sorted(rd_engine.SUCCESS_THRESHOLDS.items())
+    items = []
+    for i, ((min_cards, max_cards), probability) in enumerate(bands):
+        upper = '' if i == len(bands) - 1 else max_cards
+        items.append(f'{min_cards}-{upper}:{fractions.Fraction(probability).limit_denominator()}')
+    return ','.join(items)
+
+
+def grid_points(args):
+    """格子点を (キー, パラメータ) として列挙
+
+    winner_takes_all では落選者の報酬を使わないので、spillover_reward を None にして
+    同じ格子点を一度だけ列挙する。
+    """
+    seen = set()
+    for values in itertools.product(
+        args.treatment,
+        args.success_reward,
+        args.spillover_reward,
+        args.card_value,
+        args.players_per_group,
+        args.thresholds,
+    ):
+        params = dict(zip(
+            ('treatment', 'success_reward', 'spillover_reward', 'card_value',
+             'players_per_group', 'thresholds'),
+            values,
+        ))
+        if rd_engine.TREATMENT_NAMES[params['treatment']] == rd_engine.WINNER_TAKES_ALL:
+            params['spillover_reward'] = None
+        key = json.dumps(params, sort_keys=True)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield key, params
+
+
+def evaluate(params):
+    """1つの格子点について均衡と期待利益を計算"""
+    engine = rd_engine.Engine(
+        # winner_takes_all の格子点は None（利益の計算には使われない）
+        spillover_reward=params['spillover_reward'] or 0,
+        success_reward=params['success_reward'],
+        card_value=params['card_value'],
+        players_per_group=params['players_per_group'],
+        success_thresholds=parse_thresholds(params['thresholds']),
+    )
+    treatment = rd_engine.TREATMENT_NAMES[params['treatment']]
+    equilibria = []
+    for profile, moments in pure_equilibria(engine, treatment):
+        total = sum(profile)
+        equilibria.append(dict(
+            profile=profile,
+            total_cards=total,
+            success_probability=engine.success_probability[total],
+            mean_payoff=sum(mean for mean, _ in moments) / len(moments),
+            payoffs=[mean for mean, _ in moments],
+            variances=[var for _, var in moments],
+        ))
+    totals = [e['total_cards'] for e in equilibria]
+    return dict(
+        num_equilibria=len(equilibria),
+        min_total_cards=min(totals, default=None),
+        max_total_cards=max(totals, default=None),
+        equilibria=equilibria,
+    )
+
+
+def load_checkpoint(path):
+    """評価済みの格子点のキーを読み込む"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)['key'])
+            except (ValueError, KeyError):
+                # 中断時に途中まで書かれた行は読み飛ばし、再計算する
+                continue
+    return done
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='R&D投資ゲームのパラメータを格子状に評価する')
+    parser.add_argument('output', help='結果を追記する JSON Lines ファイル（再開時も同じパス）')
+    parser.add_argument('--treatment', type=lambda s: s.split(','),
+                        default=sorted(rd_engine.TREATMENT_NAMES))
+    parser.add_argument('--success-reward', type=parse_int_list,
+                        default=[rd_engine.SUCCESS_REWARD])
+    parser.add_argument('--spillover-reward', type=parse_int_list, default=[700, 1300])
+    parser.add_argument('--card-value', type=parse_int_list, default=[rd_engine.CARD_VALUE])
+    parser.add_argument('--players-per-group', type=parse_int_list,
+                        default=[rd_engine.PLAYERS_PER_GROUP])
+    parser.add_argument('--thresholds', action='append',
+                        help='閾値スケジュール（複数指定可）例: "0-4:0,5-11:1/3,12-16:1/2,17-:2/3"')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+    if not args.thresholds:
+        args.thresholds = [default_thresholds()]
+    for name in args.treatment:
+        if name not in rd_engine.TREATMENT_NAMES:
+            parser.error(f'unknown treatment: {name}')
+
+    done = load_checkpoint(args.output)
+    pending = [(key, params) for key, params in grid_points(args) if key not in done]
+    print(f'{len(done)} 点は評価済み, {len(pending)} 点を評価します')
+
+    with open(args.output, 'a', encoding='utf-8') as out, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(evaluate, params): (key, params) for key, params in pending}
+        for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            key, params = futures[future]
+            out.write(json.dumps(dict(key=key, params=params, result=future.result())) + '\n')
+            # 1点ごとに書き出し、中断時も評価済みの点を失わない
+            out.flush()
+            print(f'[{i}/{len(pending)}] {key}')
+
+
+if __name__ == '__main__':
+    main()
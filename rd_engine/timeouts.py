@@ -0,0 +1,52 @@
+"""
+ページのタイムアウトと自動決定
+
+セッション設定で意思決定ページ・結果ページの制限時間を指定できる
+（decision_timeout, results_timeout, 秒。0 または省略でタイムアウトなし）。
+意思決定ページで時間切れになった参加者の選択は timeout_policy で決める。
+
+- "zero": 投資・エフォートを 0 にする（既定）
+- "repeat": 前のラウンドと同じ選択を繰り返す（1ラウンド目は 0）
+- "best_response": 他の参加者が前のラウンドと同じ選択をすると仮定した最適反応
+  （1ラウンド目は他の参加者の選択を 0 とみなす）
+
+自動で決めたラウンドは player.timeout_happened に記録される。
+"""
+import functools
+
+from rd_engine.simulate import best_response_table
+
+ZERO = 'zero'
+REPEAT = 'repeat'
+BEST_RESPONSE = 'best_response'
+POLICIES = (ZERO, REPEAT, BEST_RESPONSE)
+
+
+def timeout_seconds(session, key):
+    """セッション設定の制限時間（秒）、なければ None"""
+    return session.config.get(key) or None
+
+
+def timeout_policy(session):
+    """セッション設定から自動決定の方式を求める"""
+    policy = session.config.get('timeout_policy', ZERO)
+    if policy not in POLICIES:
+        raise ValueError(f'未知の timeout_policy です: {policy}（{", ".join(POLICIES)} のいずれか）')
+    return policy
+
+
+@functools.lru_cache(maxsize=None)
+def best_responses(engine, treatment):
+    """他プレイヤーの合計枚数 → 最適な投資枚数（同点なら少ない方）の表"""
+    return [row['best'][0] for row in best_response_table(engine, treatment)]
+
+
+def auto_cards(player, engine, treatment):
+    """R&Dゲームで時間切れになったプレイヤーの投資枚数を決める"""
+    policy = timeout_policy(player.session)
+    history = player.participant.vars if player.round_number > 1 else {}
+    if policy == REPEAT:
+        return history.get('last_cards', 0)
+    if policy == BEST_RESPONSE:
+        return best_responses(engine, treatment)[history.get('last_others_total', 0)]
+    return 0
@@ -28,6 +28,9 @@ SESSION_CONFIGS = [
         display_name="Two-Stage Contest",
         num_demo_participants=12,
         app_sequence=['two_stage_contest'],
+        players_per_group=2,
+        # 能力 a の決め方: "uniform"（cost_min〜cost_max）, "discrete"（cost_types, cost_weights）, "file"（cost_file）
+        cost_distribution="uniform",
     ),
 ]
 
@@ -37,7 +40,31 @@ SESSION_CONFIGS = [
 # e.g. self.session.config['participation_fee']
 
 SESSION_CONFIG_DEFAULTS = dict(
-    real_world_currency_per_point=1.00, participation_fee=0.00, doc=""
+    real_world_currency_per_point=1.00, participation_fee=0.00, doc="",
+    # True にすると全グループの到着を待ち、サブセッション単位で結果を一括計算する
+    wait_for_all_groups=False,
+    # True にするとR&Dゲームの投資を live_method で送信し、待機ページなしで結果を表示する
+    # （結果はグループ単位で計算するため wait_for_all_groups は使われない）
+    live_investment=False,
+    # グループの組み替え: "partner"（固定）, "stranger"（毎ラウンド無作為）, "perfect_stranger"（同じ相手と二度組まない）
+    matching="partner",
+    # True にすると待機ページに到着した順にグループを作る（遅い参加者を待たずに進められる）
+    group_by_arrival_time=False,
+    # 意思決定ページ・結果ページの制限時間（秒、0 で制限なし）
+    decision_timeout=0,
+    results_timeout=0,
+    # 時間切れ時の自動決定: "zero"（0 にする）, "repeat"（前回と同じ）, "best_response"（前回の他者の選択への最適反応）
+    timeout_policy="zero",
+    # セッション作成時にボットにする参加者の数（空席を埋める、id_in_session の大きい順）
+    bot_seats=0,
+    # True にすると意思決定ページで時間切れになった参加者を以後ボットが引き継ぐ
+    bot_takeover=False,
+    # True にすると結果の計算と creating_session を cProfile で計測し、profile_dir/<セッションコード>/ に保存する
+    profile_callbacks=False,
+    profile_dir="profiles",
+    # "decisions.sqlite3" や "decisions.jsonl" のように指定すると、グループごとの結果を別スレッドで追記する
+    decision_log="",
+    # random_seed=12345 のように指定すると乱数を固定できる（省略時はセッションコードから導出）
 )
 
 PARTICIPANT_FIELDS = []
@@ -1,3 +1,4 @@
+import bisect
 import random
 
 from otree.api import (
@@ -10,6 +11,8 @@ from otree.api import (
     models,
 )
 
+from rd_engine import bots, bulk, decision_log, instrumentation, matching, report, rng, timeouts
+
 doc = """
 Your app description
 """
@@ -17,27 +20,39 @@ Your app description
 
 class C(BaseConstants):
     NAME_IN_URL = "two_stage_contest"
-    PLAYERS_PER_GROUP = 2
+    # グループの人数はセッション設定 players_per_group（3〜20人も可）で決める
+    PLAYERS_PER_GROUP = None
+    DEFAULT_PLAYERS_PER_GROUP = 2
     NUM_ROUNDS = 2
     INSTRUCTION_CONTENTS = "two_stage_contest/Instruction_contents.html"    
+    # 管理画面の利得合計の分布の階級の幅
+    REPORT_BIN_WIDTH = 250
 
     ############### この部分を変更すること #################################
     # 報酬設定
     REWARDS = {
-        "Winner_Rewards": [500, 1500],  # [Round 1, Round 2] で得られる報酬
-        "Loser_Rewards": [0, 0],  # [Round 1, Round 2] で得られる報酬
+        # [Round 1, Round 2] で各順位 [1位, 2位, ...] が得られる報酬（記載のない順位は0）
+        "Rank_Rewards": [[500, 0], [1500, 0]],
+        # 1位の a*x がこの値未満だと報酬の一部が2位に移転する（ラウンドごと、昇順）
+        "Transfer_Thresholds": [[300, 400], [1300, 1400]],
+        # 閾値で区切った区間ごとの移転額（a*x < 閾値1, 閾値1 ≤ a*x < 閾値2, 閾値2 ≤ a*x）
+        "Transfers": [[150, 50, 0], [400, 100, 0]],
     }
     ############### ここまで ############################################
-
-    # HTML表示用に変数仮置き
-    R11 = REWARDS["Winner_Rewards"][0]
-    R12 = REWARDS["Winner_Rewards"][1]
-    R21 = REWARDS["Loser_Rewards"][0]
-    R22 = REWARDS["Loser_Rewards"][1]
+    # 説明・意思決定ページの報酬の表は REWARDS とグループの人数から reward_rules で作る
 
 
 class Subsession(BaseSubsession):
-    pass
+    random_seed = models.StringField()  # 乱数シード（再現・監査用）
+    # 管理画面のレポート用の集計（set_payoffs でグループごとに加算、rd_engine.report）
+    report_groups = models.IntegerField(initial=0)
+    report_players = models.IntegerField(initial=0)
+    report_effort = models.IntegerField(initial=0)
+    report_wins = models.IntegerField(initial=0)
+    report_ties = models.IntegerField(initial=0)
+    report_losses = models.IntegerField(initial=0)
+    report_payoff = models.FloatField(initial=0)
+    report_bins = models.LongStringField(initial="{}")  # 累積利益の階級ごとの人数の増減（JSON）
 
 
 class Group(BaseGroup):
@@ -50,157 +65,451 @@ class Player(BasePlayer):
         label="投入するエフォートの大きさを入力して下さい。",
     )
     cost = models.IntegerField(
-        initial=-1,  # 初期値は−1とし、before_next_page　で設定
+        initial=-1,  # 初期値は−1とし、creating_session で設定
     )
     reward = models.FloatField(initial=0)  # 得られた報酬を格納する変数
     win_flg = models.IntegerField(initial=-1)  # 0:負け, 1:引き分け, 2:勝ち
+    rank = models.IntegerField(initial=-1)  # グループ内の順位（同じエフォートは同順位）
+    tied = models.BooleanField(initial=False)  # 同順位の参加者がいるか
+    total_payoff = models.FloatField(initial=0)  # このラウンドまでの利得合計
+    prev_effort = models.IntegerField(initial=-1)  # 前ラウンドのエフォート（結果ページ用）
+    prev_state = models.StringField(initial="")  # 前ラウンドの順位（結果ページ用）
+    timeout_happened = models.BooleanField(initial=False)  # 時間切れでエフォートを自動で決めたか
+    is_bot = models.BooleanField(initial=False)  # ボット席がエフォートを決めたか
 
 
 # 　FUNCTIONS
 def creating_session(subsession: Subsession):
-    num = subsession.session.num_participants
-    subsession.session.vars["costs"] = [ random.randint(1, 100) for i in range(num) ]            
+    seed = rng.session_seed(subsession.session)
+    subsession.random_seed = str(seed)
+
+    # 能力 a は1ラウンド目に参加者ごとに一度だけ決め、全ラウンドで同じ値を使う
+    if subsession.round_number == 1:
+        bots.assign_bot_seats(subsession)
+        players = subsession.get_players()
+        costs = draw_costs(subsession.session, len(players), rng.seeded_random(seed, "costs"))
+        for player, cost in zip(players, costs):
+            player.participant.vars["cost"] = cost
+    for player in subsession.get_players():
+        player.cost = player.participant.vars["cost"]
+
+    # グループ分け（セッション設定 matching、到着順の場合は ArrivalWaitPage で行う）
+    if not matching.by_arrival(subsession.session):
+        if subsession.round_number == 1:
+            subsession.session.vars["matching_schedule"] = matching.build_schedule(
+                len(subsession.get_players()),
+                group_size(subsession),
+                C.NUM_ROUNDS,
+                matching.matching_mode(subsession.session),
+                rng.seeded_random(seed, "matching"),
+            )
+        matching.apply_schedule(subsession, subsession.session.vars["matching_schedule"])
 
 
-def effort_max(player: Player):
-    return int(C.REWARDS["Winner_Rewards"][player.round_number - 1] / player.cost)
+def group_by_arrival_time_method(subsession: Subsession, waiting_players):
+    return matching.arrival_group(subsession, waiting_players, group_size(subsession))
 
 
-def set_payoffs(group: Group):
-    for player in group.get_players():
-        opponent = group.get_player_by_id(player.id_in_group % 2 + 1)
-        player_effort_value = player.cost * player.effort
-        opponent_effort_value = opponent.cost * opponent.effort
-
-        if player.effort > opponent.effort:  # 勝者の場合
-            if group.round_number == 1:  # 第一ラウンド
-                if player_effort_value < 300:
-                    player.reward = 350  # 500 - 150
-                    opponent.reward = 150
-                elif player_effort_value < 400:
-                    player.reward = 450  # 500 - 50
-                    opponent.reward = 50
-                else:
-                    player.reward = 500
-                    opponent.reward = 0
-            else:  # 第二ラウンド
-                if player_effort_value < 1300:
-                    player.reward = 1100  # 1500 - 400
-                    opponent.reward = 400
-                elif player_effort_value < 1400:
-                    player.reward = 1400  # 1500 - 100
-                    opponent.reward = 100
-                else:
-                    player.reward = 1500
-                    opponent.reward = 0
-            player.win_flg = 2  # Winner
-            opponent.win_flg = 0  # Loser
-        elif player.effort == opponent.effort:  # 引き分けの場合
-            if group.round_number == 1:  # 第一ラウンド
-                player.reward = 250  # 500 / 2
-                opponent.reward = 250
-            else:  # 第二ラウンド
-                player.reward = 750  # 1500 / 2
-                opponent.reward = 750
-            player.win_flg = 1  # Tie
-            opponent.win_flg = 1  # Tie
-        else:  # 敗者の場合
-            if group.round_number == 1:  # 第一ラウンド
-                if opponent_effort_value < 300:
-                    player.reward = 150
-                    opponent.reward = 350  # 500 - 150
-                elif opponent_effort_value < 400:
-                    player.reward = 50
-                    opponent.reward = 450  # 500 - 50
-                else:
-                    player.reward = 0
-                    opponent.reward = 500
-            else:  # 第二ラウンド
-                if opponent_effort_value < 1300:
-                    player.reward = 400
-                    opponent.reward = 1100  # 1500 - 400
-                elif opponent_effort_value < 1400:
-                    player.reward = 100
-                    opponent.reward = 1400  # 1500 - 100
+def draw_costs(session, num, generator=random):
+    """セッション設定 cost_distribution に従って num 人分の能力 a を決める
+
+    - "uniform": cost_min〜cost_max の一様分布（既定: 1〜100）
+    - "discrete": cost_types（例: "10,50,90"）から cost_weights の重みで抽選
+    - "file": cost_file に1行1人ずつ記載した値を参加者の順に割り当て
+    """
+    config = session.config
+    distribution = config.get("cost_distribution", "uniform")
+    if distribution == "uniform":
+        return [
+            generator.randint(config.get("cost_min", 1), config.get("cost_max", 100))
+            for i in range(num)
+        ]
+    if distribution == "discrete":
+        types = parse_numbers(config["cost_types"])
+        weights = parse_numbers(config["cost_weights"]) if "cost_weights" in config else None
+        return generator.choices(types, weights=weights, k=num)
+    if distribution == "file":
+        with open(config["cost_file"], encoding="utf-8") as f:
+            costs = [int(line) for line in f if line.strip()]
+        if len(costs) < num:
+            raise ValueError(f"{config['cost_file']} には {num} 人分の能力が必要です")
+        return costs[:num]
+    raise ValueError(f"未知の cost_distribution です: {distribution}")
+
+
+def parse_numbers(value):
+    # セッション設定ではリストを "10,50,90" のような文字列でも指定できる
+    if isinstance(value, str):
+        return [int(v) for v in value.split(",")]
+    return list(value)
+
+
+def group_size(obj):
+    return obj.session.config.get("players_per_group", C.DEFAULT_PLAYERS_PER_GROUP)
+
+
+def effort_max(player: Player):
+    return int(C.REWARDS["Rank_Rewards"][player.round_number - 1][0] / player.cost)
+
+
+def transfer_amount(round_number, effort_value):
+    """1位の a*x から2位へ移転する報酬額を求める"""
+    thresholds = C.REWARDS["Transfer_Thresholds"][round_number - 1]
+    return C.REWARDS["Transfers"][round_number - 1][bisect.bisect_right(thresholds, effort_value)]
+
+
+def rank_rewards(round_number, size):
+    """順位ごとの報酬をグループの人数分に揃える"""
+    rewards = C.REWARDS["Rank_Rewards"][round_number - 1][:size]
+    return rewards + [0] * (size - len(rewards))
+
+
+def reward_rules(size):
+    """説明・意思決定ページに表示する報酬のルール（ラウンドごと）
+
+    rank_rows は順位ごとの報酬（列がラウンド）、各ラウンドの bands は1位の a*x の
+    区間ごとの移転額と1位・2位の報酬（a*x の大きい区間から順に、移転がなければ空）。
+    """
+    rounds = []
+    for round_number in range(1, C.NUM_ROUNDS + 1):
+        rewards = rank_rewards(round_number, size)
+        thresholds = C.REWARDS["Transfer_Thresholds"][round_number - 1]
+        transfers = C.REWARDS["Transfers"][round_number - 1]
+        bands = []
+        if size > 1 and thresholds:
+            for low, high, transfer in zip([None] + thresholds, thresholds + [None], transfers):
+                if low is None:
+                    condition, formula = f"{high}未満", f"a*x < {high}"
+                elif high is None:
+                    condition, formula = f"{low}以上", f"{low} ≤ a*x"
                 else:
-                    player.reward = 0
-                    opponent.reward = 1500
-            player.win_flg = 0  # Loser
-            opponent.win_flg = 2  # Winner
+                    condition, formula = f"{low}以上{high}未満", f"{low} ≤ a*x < {high}"
+                bands.append(dict(
+                    condition=condition,
+                    formula=formula,
+                    transfer=transfer,
+                    first=rewards[0] - transfer,
+                    second=rewards[1] + transfer,
+                ))
+            bands.reverse()
+            for i, band in enumerate(bands):
+                band["color"] = "green" if i == 0 else "red" if i == len(bands) - 1 else "orange"
+        rounds.append(dict(
+            round_number=round_number,
+            total=sum(rewards),
+            first=rewards[0],
+            second=rewards[1] if size > 1 else None,
+            # この値以上で1位が満額を得る（移転がなければ None）
+            full_from=thresholds[-1] if bands and not transfers[-1] else None,
+            bands=bands,
+            ranks=[
+                dict(rank=i + 1, reward=reward, is_first=i == 0 and bool(bands), is_second=i == 1 and bool(bands))
+                for i, reward in enumerate(rewards)
+            ],
+        ))
+    has_transfer = any(rule["bands"] for rule in rounds)
+    rank_rows = [
+        dict(
+            rank=i + 1,
+            rewards=[rule["ranks"][i]["reward"] for rule in rounds],
+            is_first=i == 0 and has_transfer,
+            is_second=i == 1 and has_transfer,
+        )
+        for i in range(size)
+    ]
+    return dict(reward_rules=rounds, rank_rows=rank_rows)
+
+
+def instruction_vars(player):
+    """説明（Instruction_contents.html）に渡す値"""
+    return dict(
+        players_per_group=group_size(player),
+        num_rounds=C.NUM_ROUNDS,
+        matching_description=matching.describe(player.session),
+        **reward_rules(group_size(player)),
+    )
+
 
+def resolve_groups(groups, round_number):
+    """各グループの [(effort, cost), ...] から [(reward, rank, tied), ...] を求める
+
+    エフォートを一度だけ降順に並べて順位を付け、同じエフォートの参加者は
+    その順位から人数分の順位の報酬を等分する。1位が単独の場合のみ、
+    1位の a*x に応じた移転額が1位の報酬から2位の報酬に移る。
+    """
+    results = []
+    for members in groups:
+        size = len(members)
+        order = sorted(range(size), key=lambda i: members[i][0], reverse=True)
+        rewards = rank_rewards(round_number, size)
+
+        # 同じエフォートの区間 [start, end) ごとに順位を付ける
+        blocks = []
+        start = 0
+        while start < size:
+            end = start + 1
+            while end < size and members[order[end]][0] == members[order[start]][0]:
+                end += 1
+            blocks.append((start, end))
+            start = end
+
+        # 単独1位の場合は報酬の一部が2位に移転する
+        if size > 1 and blocks[0] == (0, 1):
+            effort, cost = members[order[0]]
+            transfer = transfer_amount(round_number, cost * effort)
+            rewards[0] -= transfer
+            rewards[1] += transfer
+
+        group_results = [None] * size
+        for start, end in blocks:
+            reward = sum(rewards[start:end]) / (end - start)
+            for i in order[start:end]:
+                group_results[i] = (reward, start + 1, end - start > 1)
+        results.append(group_results)
+    return results
+
+
+def apply_results(players, results):
+    # 管理画面の分布用の (前ラウンドまでの利得合計, 今回までの利得合計)
+    moves = []
+    # player.payoff は set_payoff の書き出しまで古い値なので、計算した利得を使う
+    payoffs = []
+    for player, (reward, rank, tied) in zip(players, results):
+        player.reward = reward
+        player.rank = rank
+        player.tied = tied
+        if rank == 1:
+            player.win_flg = 1 if tied else 2  # Tie / Winner
+        else:
+            player.win_flg = 0  # Loser
         # 利得の計算
-        player.payoff = player.reward - player.cost * player.effort
-        opponent.payoff = opponent.reward - opponent.cost * opponent.effort
+        payoff = player.reward - player.cost * player.effort
+        bulk.set_payoff(player, payoff)
+        payoffs.append(payoff)
+        # 利得合計は参加者変数に持ち越し、過去ラウンドを読み直さない
+        previous = player.participant.vars.get("total_payoff", 0) if player.round_number > 1 else 0
+        player.total_payoff = previous + float(payoff)
+        player.participant.vars["total_payoff"] = player.total_payoff
+        moves.append((previous if player.round_number > 1 else None, player.total_payoff))
+        # 前ラウンドの結果を写してから、今回の結果を次のラウンド用に持ち越す
+        if player.round_number > 1:
+            player.prev_effort, player.prev_state = player.participant.vars["last_result"]
+        player.participant.vars["last_result"] = (player.effort, rank_label(player))
+        # 時間切れ時の最適反応（best_response）用に対戦相手の選択を持ち越す
+        player.participant.vars["last_rivals"] = [
+            (p.effort, p.cost) for p in players if p is not player
+        ]
+    # 分析用の意思決定ログ（設定時のみ、書き込みは別スレッド）
+    first = players[0]
+    winners = [p.id_in_group for p in players if p.rank == 1]
+    decision_log.record(
+        first.session, __name__, first.round_number, first.group.id_in_subsession,
+        [[p.effort, p.cost] for p in players], payoffs,
+        winner=winners[0] if len(winners) == 1 else None,
+    )
+    # 管理画面のレポート用の集計に加える
+    report.record_group(
+        first.subsession,
+        dict(
+            groups=1,
+            players=len(players),
+            effort=sum(p.effort for p in players),
+            wins=sum(p.win_flg == 2 for p in players),
+            ties=sum(p.win_flg == 1 for p in players),
+            losses=sum(p.win_flg == 0 for p in players),
+            payoff=sum(float(payoff) for payoff in payoffs),
+        ),
+        moves,
+        C.REPORT_BIN_WIDTH,
+    )
+
+
+def auto_effort(player: Player):
+    """時間切れのプレイヤーのエフォートを決める
+
+    ボット席は常に最適反応、それ以外はセッション設定 timeout_policy に従う。
+    """
+    if bots.is_bot(player.participant):
+        player.effort = best_response_effort(player)
+        player.is_bot = True
+        return
+    policy = timeouts.timeout_policy(player.session)
+    if policy == timeouts.REPEAT and player.round_number > 1:
+        player.effort = min(player.participant.vars["last_result"][0], effort_max(player))
+    elif policy == timeouts.BEST_RESPONSE:
+        player.effort = best_response_effort(player)
+    else:
+        player.effort = 0
+    player.timeout_happened = True
+    # bot_takeover 設定時は、以後のラウンドをボットが引き継ぐ
+    bots.take_over(player.participant)
+
+
+def best_response_effort(player: Player):
+    # 対戦相手が前ラウンドと同じエフォートを選ぶと仮定（1ラウンド目は 0）
+    history = player.participant.vars if player.round_number > 1 else {}
+    rivals = history.get("last_rivals") or [(0, 0)] * (group_size(player) - 1)
+    return best_effort(player.cost, rivals, player.round_number, effort_max(player))
+
+
+def best_effort(cost, rivals, round_number, limit):
+    """対戦相手の (effort, cost) に対して利得が最大になるエフォート（同点なら小さい方）"""
+    best, best_payoff = 0, None
+    for effort in range(limit + 1):
+        reward = resolve_groups([[(effort, cost)] + list(rivals)], round_number)[0][0][0]
+        payoff = reward - cost * effort
+        if best_payoff is None or payoff > best_payoff:
+            best, best_payoff = effort, payoff
+    return best
+
+
+def rank_label(player):
+    """順位の表示用文字列"""
+    if player.tied:
+        return f"{player.rank}位（引き分け）"
+    return f"{player.rank}位"
+
+
+def set_payoffs(group: Group):
+    players = group.get_players()
+    results = resolve_groups([[(p.effort, p.cost) for p in players]], group.round_number)
+    with bulk.resolving(players, "participant"):
+        apply_results(players, results[0])
+
+
+def set_payoffs_all(subsession: Subsession):
+    # 全プレイヤーを一度だけ取得し、全グループをまとめて解決する
+    players = subsession.get_players()
+    # グループと参加者をまとめて読み込み、全グループの更新を最後に一度だけ書き出す
+    with bulk.resolving(players, "group", "participant"):
+        players_by_group = {}
+        for p in players:
+            players_by_group.setdefault(p.group, []).append(p)
+        groups = []
+        for group_players in players_by_group.values():
+            group_players.sort(key=lambda p: p.id_in_group)
+            groups.append([(p.effort, p.cost) for p in group_players])
+        results = resolve_groups(groups, subsession.round_number)
+        for group_players, group_results in zip(players_by_group.values(), results):
+            apply_results(group_players, group_results)
+
+
+def vars_for_admin_report(subsession: Subsession):
+    # set_payoffs で加算した集計を読むだけ（プレイヤーの表は読まない）
+    subsessions = subsession.in_rounds(1, C.NUM_ROUNDS)
+    return report.contest_vars(subsessions, subsession.round_number, C.REPORT_BIN_WIDTH)
+
+
+def custom_export(players):
+    # 1プレイヤー・1ラウンドにつき1行（グループ等は oTree が結合して読み込む）
+    yield [
+        "session_code", "round_number", "participant_code", "group", "id_in_group",
+        "players_per_group", "cost", "effort", "reward", "rank", "tied", "win_flg",
+        "payoff", "total_payoff",
+    ]
+    for p in players:
+        yield [
+            p.session.code, p.round_number, p.participant.code, p.group.id_in_subsession,
+            p.id_in_group, group_size(p), p.cost, p.effort, p.reward, p.rank, p.tied,
+            p.win_flg, p.payoff, p.total_payoff,
+        ]
 
 
 # PAGES
+class ArrivalWaitPage(WaitPage):
+    # 到着した順にグループを作る（セッション設定 group_by_arrival_time）
+    group_by_arrival_time = True
+
+    @staticmethod
+    def is_displayed(player):
+        return matching.regroups_on_arrival(player.session, player.round_number)
+
+
 class Instruction(Page):
     @staticmethod
     def is_displayed(player):
         return player.round_number == 1  # Round 1だけこのページに入る
 
+    @staticmethod
+    def get_timeout_seconds(player):
+        return bots.page_timeout(player)
+
+    @staticmethod
+    def vars_for_template(player):
+        return instruction_vars(player)
+
 
 class Decision(Page):
     form_model = "player"
     form_fields = ["effort"]
 
     @staticmethod
-    def is_displayed(player):        
-        # 各プレイヤのcostの値をを保存
-        player.cost = player.subsession.session.vars["costs"][player.id_in_subsession - 1]
-        return True  # 前プレイヤがこのページに入る
+    def get_timeout_seconds(player):
+        return bots.page_timeout(player, "decision_timeout")
+
+    @staticmethod
+    def before_next_page(player, timeout_happened):
+        if timeout_happened:
+            auto_effort(player)
+
+    @staticmethod
+    def js_vars(player):
+        # 利得の計算機用の表（サーバーに問い合わせずにページ内で計算し、入力も確認する）
+        thresholds = C.REWARDS["Transfer_Thresholds"][player.round_number - 1]
+        return dict(
+            cost=player.cost,
+            effort_max=effort_max(player),
+            rank_rewards=rank_rewards(player.round_number, group_size(player)),
+            # 1位の a*x の区間ごとの [下限, 移転額]
+            transfer_schedule=list(zip([0] + thresholds, C.REWARDS["Transfers"][player.round_number - 1])),
+        )
 
     @staticmethod
     def vars_for_template(player):
+        rules = instruction_vars(player)
+        # このラウンドの報酬の表
+        rules["round_rule"] = rules["reward_rules"][player.round_number - 1]
         if player.round_number > 1:
-            prev_player = player.in_round(player.round_number - 1)
-            if prev_player.win_flg == 2:
-                prev_state = "1位"
-            elif prev_player.win_flg == 1:
-                prev_state = "引き分け"
-            else:
-                prev_state = "2位"
+            prev_effort, prev_state = player.participant.vars["last_result"]
             return dict(
-                prev_effort=prev_player.effort,
+                prev_effort=prev_effort,
                 prev_state=prev_state,
+                **rules,
             )
         else:
             return dict(
                 prev_effort=-1,
                 prev_state="",
+                **rules,
             )
 
 
 class ResultsWaitPage(WaitPage):
     after_all_players_arrive = "set_payoffs"
 
+    @staticmethod
+    def is_displayed(player):
+        return not player.session.config.get("wait_for_all_groups", False)
+
+
+class AllGroupsResultsWaitPage(WaitPage):
+    wait_for_all_groups = True
+    after_all_players_arrive = "set_payoffs_all"
+
+    @staticmethod
+    def is_displayed(player):
+        return player.session.config.get("wait_for_all_groups", False)
+
 
 class Results(Page):
+    # 表示内容は set_payoffs で保存したフィールド（total_payoff, prev_effort, prev_state）のみ
+
     @staticmethod
-    def vars_for_template(player):
-        total_payoff = 0
-        for p in player.in_all_rounds():
-            total_payoff += p.payoff
+    def get_timeout_seconds(player):
+        return bots.page_timeout(player, "results_timeout")
 
-        if player.round_number > 1:
-            prev_player = player.in_round(player.round_number - 1)
-            if prev_player.win_flg == 2:
-                prev_state = "1位"
-            elif prev_player.win_flg == 1:
-                prev_state = "引き分け"
-            else:
-                prev_state = "2位"
-            return dict(
-                prev_effort=prev_player.effort,
-                prev_state=prev_state,
-                total_payoff=total_payoff,
-            )
-        else:
-            return dict(
-                prev_effort=-1,
-                prev_state="",
-                total_payoff=total_payoff,
-            )
 
+page_sequence = [ArrivalWaitPage, Instruction, Decision, ResultsWaitPage, AllGroupsResultsWaitPage, Results]
 
-page_sequence = [Instruction, Decision, ResultsWaitPage, Results]
+# 処理時間の計測・プロファイル（環境変数・セッション設定で有効なものだけ）
+instrumentation.instrument(__name__)
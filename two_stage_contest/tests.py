@@ -0,0 +1,22 @@
+from otree.api import Bot, Submission, SubmissionMustFail, expect
+import random
+from . import *
+
+
+class PlayerBot(Bot):
+    def play_round(self):
+        if self.round_number == 1:
+            yield Instruction
+        yield SubmissionMustFail(Decision, dict(effort=effort_max(self.player) + 1))
+        yield Decision, dict(effort=random.randint(0, effort_max(self.player)))
+
+        # 順位はエフォートの降順、報酬の合計は順位ごとの報酬の合計と一致すること
+        players = self.group.get_players()
+        for p in players:
+            expect(p.rank, 1 + sum(q.effort > p.effort for q in players))
+        expect(sum(p.reward for p in players), sum(rank_rewards(self.round_number, len(players))))
+
+        rounds = self.player.in_all_rounds()
+        expect(self.player.total_payoff, sum(float(p.payoff) for p in rounds))
+        if self.round_number < C.NUM_ROUNDS:
+            yield Results